@@ -0,0 +1,82 @@
+"""Full register rewrites vs. change detection, in process.
+
+Feeds the register images of a simulated meter into SnapshotDataBlock, once through the
+previous full rewrite and once through update(), which writes only the changed spans and
+skips unchanged images. With --polls-per-sample > 1 several polls see the same Shelly
+sample, like polling faster than the Shelly measures. Between two updates, --reads
+Modbus reads of 40001-40195 go through the encoded response cache.
+
+Reports the time per update, registers written per update, and the time the reads
+took, which grows with every cache invalidation.
+
+Run from the repository root:
+    python bench/bench_change_detection.py [--samples 2000] [--polls-per-sample 1 5] [--reads 8]
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from encoder import RegisterEncoder
+from meter import OFFSET_KEYS
+from modbus import create_datablock
+from pipeline import TransformPipeline
+from shelly_data import MeterSimulator
+
+READS = [(1, 125), (126, 70)]  # 40001-40125 and 40126-40195
+
+
+def register_images(samples, seed=1):
+    simulator = MeterSimulator(seed)
+    encoder = RegisterEncoder()
+    pipeline = TransformPipeline({key: 0 for key in OFFSET_KEYS}, [], encoder)
+    images = []
+    for _ in range(samples):
+        simulator.step()
+        data = {**simulator.em_status(), **simulator.emdata_status()}
+        images.append(encoder.encode_values(pipeline.run(data)).tolist())
+    return encoder.start, images
+
+
+def run(address, images, polls_per_sample, reads, detect_changes):
+    datablock = create_datablock()
+    write = datablock.update if detect_changes else datablock.setValues
+    written = 0
+    update_time = read_time = 0.0
+    for image in images:
+        for _ in range(polls_per_sample):
+            started = time.perf_counter()
+            changed = write(address, image)
+            updated = time.perf_counter()
+            for _ in range(reads):
+                for start, count in READS:
+                    datablock.getEncoded(start, count)
+            read_time += time.perf_counter() - updated
+            update_time += updated - started
+            written += len(image) if changed is None else changed
+    updates = len(images) * polls_per_sample
+    return update_time / updates, written / updates, read_time / updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=2000, help="distinct Shelly samples")
+    parser.add_argument("--polls-per-sample", type=int, nargs="+", default=[1, 5], help="polls seeing each sample")
+    parser.add_argument("--reads", type=int, default=8, help="Modbus reads of all registers between two updates")
+    args = parser.parse_args()
+
+    address, images = register_images(args.samples)
+    for polls in args.polls_per_sample:
+        print(f"\n{polls} poll(s) per sample, {args.reads} reads between updates")
+        for label, detect_changes in (("full rewrite", False), ("change detection", True)):
+            update, written, read = run(address, images, polls, args.reads, detect_changes)
+            print(f"  {label:17} update {update * 1e6:6.1f} us, {written:5.1f} registers written, "
+                  f"reads {read * 1e6:6.1f} us per update")
+
+
+if __name__ == "__main__":
+    main()
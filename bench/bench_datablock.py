@@ -0,0 +1,117 @@
+"""Contention benchmark: many concurrent readers against a fast writer.
+
+Compares the old lock-protected sparse block with SnapshotDataBlock. Reader threads
+read the 128 register payload every read interval (0: in a tight loop) while a writer
+publishes images in which every register holds the same sample number, so a torn read
+is easy to spot. The writer keeps a fixed schedule: a write it could not make in time
+is counted as missed instead of delaying the following ones, so both blocks are compared
+at the same write rate as long as neither misses writes.
+
+Run from the repository root:
+    python bench/bench_datablock.py [--readers 16] [--seconds 3] [--write-interval 0.001] [--read-interval 0.001]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pymodbus.datastore import ModbusSparseDataBlock
+
+from modbus import SnapshotDataBlock
+
+
+class LockedSparseDataBlock(ModbusSparseDataBlock):
+    """The previous thread-safe sparse block, kept here as baseline."""
+
+    def __init__(self, values, lock):
+        super().__init__(values)
+        self.lock = lock
+
+    def getValues(self, address, count=1):
+        with self.lock:
+            return super().getValues(address, count)
+
+    def setValues(self, address, values):
+        with self.lock:
+            return super().setValues(address, values)
+
+
+def run(datablock, readers, seconds, write_interval, read_interval):
+    go = threading.Event()
+    stop = threading.Event()
+    stats = []
+
+    def reader():
+        go.wait()
+        reads = torn = 0
+        worst = 0.0
+        while not stop.is_set():
+            start = time.perf_counter()
+            values = datablock.getValues(72, 128)
+            elapsed = time.perf_counter() - start
+            worst = max(worst, elapsed)
+            if values[0] != values[-1]:
+                torn += 1
+            reads += 1
+            if read_interval:
+                time.sleep(read_interval)
+        stats.append((reads, torn, worst))
+
+    def writer():
+        go.wait()
+        writes = missed = 0
+        deadline = time.perf_counter()
+        while not stop.is_set():
+            now = time.perf_counter()
+            if now < deadline:
+                time.sleep(deadline - now)
+                continue
+            late = int((now - deadline) / write_interval)
+            missed += late
+            deadline += (late + 1) * write_interval
+            writes += 1
+            datablock.setValues(72, [writes & 0xFFFF] * 128)
+        stats.append(("writes", writes, missed))
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)] + [threading.Thread(target=writer)]
+    for thread in threads:
+        thread.start()
+    go.set()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    reads = sum(s[0] for s in stats if s[0] != "writes")
+    torn = sum(s[1] for s in stats if s[0] != "writes")
+    worst = max(s[2] for s in stats if s[0] != "writes")
+    writes, missed = next(s[1:] for s in stats if s[0] == "writes")
+    return reads / seconds, writes / seconds, missed, torn, worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--write-interval", type=float, default=0.001)
+    parser.add_argument("--read-interval", type=float, default=0.001, help="pause of each reader between reads")
+    args = parser.parse_args()
+
+    candidates = {
+        "LockedSparseDataBlock": LockedSparseDataBlock({1: [0] * 199}, threading.Lock()),
+        "SnapshotDataBlock": SnapshotDataBlock(1, [0] * 199),
+    }
+    print(f"{args.readers} readers every {args.read_interval * 1000:.1f} ms, "
+          f"writer every {args.write_interval * 1000:.1f} ms, {args.seconds:.0f} s each")
+    for name, datablock in candidates.items():
+        reads, writes, missed, torn, worst = run(datablock, args.readers, args.seconds, args.write_interval,
+                                                 args.read_interval)
+        print(f"{name:22} {reads:12,.0f} reads/s {writes:8,.0f} writes/s  missed writes: {missed}  "
+              f"torn reads: {torn}  worst read: {worst * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""End-to-end benchmark of the gateway without any hardware.
+
+Starts a fake Shelly (bench/fake_shelly.py --stamp) and the gateway (main.py) as
+subprocesses on free local ports, then
+  1. measures poll-to-visible latency: how long after the fake Shelly sent a sample
+     it can be read over Modbus (the sample's send time travels in PhVphA),
+  2. runs N concurrent Modbus client processes, built on reader.py, that read
+     40001-40195 in two block reads as fast as they can, and reports request
+     throughput, request latency percentiles, gateway CPU time per request and
+     poll-to-visible latency under that load.
+
+Linux only (gateway CPU time is read from /proc). Run from the repository root:
+    python bench/bench_e2e.py [--clients 8] [--seconds 10] [--latency 0.05] [--jitter 0.03]
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from pymodbus.client import ModbusTcpClient
+
+import reader
+
+BLOCKS = [(1, 125), (126, 70)]  # 40001-40125 and 40126-40195
+STAMP_ADDRESS = 82  # PhVphA, carries the fake Shelly's send time
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Nothing listening on port {port}")
+
+
+def cpu_seconds(pid):
+    """CPU time of a process and its running descendants, e.g. server workers."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        children = []
+    for child in children:
+        try:
+            seconds += cpu_seconds(child)
+        except OSError:
+            pass  # Exited meanwhile
+    return seconds
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def connect(port):
+    client = ModbusTcpClient("127.0.0.1", port=port)
+    client.connect()
+    return client
+
+
+def watch_latency(port, seconds, results):
+    """Poll the stamp register and record how old each new sample is when it first shows up."""
+    client = connect(port)
+    latencies = []
+    last = None
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        stamp = reader.convert_float32(reader.read_modbus_register(client, STAMP_ADDRESS, 2))
+        if stamp != last:
+            if last is not None:
+                latencies.append(((time.time() % 60) - stamp) % 60)
+            last = stamp
+        time.sleep(0.002)
+    client.close()
+    results.put(("latency", latencies))
+
+
+def load_client(port, seconds, results, rate=0):
+    """Read all blocks in a loop, rate times per second or as fast as possible with rate 0."""
+    client = connect(port)
+    durations = []
+    started = time.monotonic()
+    deadline = started + seconds
+    rounds = 0
+    while time.monotonic() < deadline:
+        for address, count in BLOCKS:
+            start = time.perf_counter()
+            reader.read_modbus_register(client, address, count)
+            durations.append(time.perf_counter() - start)
+        rounds += 1
+        if rate:
+            time.sleep(max(0, started + rounds / rate - time.monotonic()))
+    client.close()
+    results.put(("load", durations))
+
+
+def run_phase(port, gateway_pid, clients, seconds, rate=0):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=watch_latency, args=(port, seconds, results))]
+    processes += [multiprocessing.Process(target=load_client, args=(port, seconds, results, rate))
+                  for _ in range(clients)]
+    cpu_before = cpu_seconds(gateway_pid)
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    cpu = cpu_seconds(gateway_pid) - cpu_before
+
+    latencies = next(values for kind, values in collected if kind == "latency")
+    durations = [d for kind, values in collected if kind == "load" for d in values]
+    return latencies, durations, cpu
+
+
+def report(title, latencies, durations, cpu, seconds):
+    print(f"\n{title}")
+    if latencies:
+        print(f"  poll-to-visible latency: median {statistics.median(latencies) * 1000:7.1f} ms  "
+              f"p99 {percentile(latencies, 99) * 1000:7.1f} ms  ({len(latencies)} samples)")
+    if durations:
+        print(f"  Modbus throughput:       {len(durations) / seconds:9,.0f} requests/s")
+        print(f"  request latency:         p50 {percentile(durations, 50) * 1000:6.2f} ms  "
+              f"p99 {percentile(durations, 99) * 1000:6.2f} ms  p99.9 {percentile(durations, 99.9) * 1000:6.2f} ms")
+        print(f"  gateway CPU per request: {cpu / len(durations) * 1e6:9.1f} us")
+    print(f"  gateway CPU:             {cpu / seconds * 100:9.1f} %")
+
+
+@contextlib.contextmanager
+def gateway(extra_config=None, latency=0.05, jitter=0.03):
+    """Run a fake Shelly and the gateway on free ports, yield (Modbus port, gateway process)."""
+    shelly_port, modbus_port = free_port(), free_port()
+    processes = []
+    with tempfile.TemporaryDirectory() as workdir:
+        config = {
+            "shelly_url": f"http://127.0.0.1:{shelly_port}/rpc/Shelly.GetStatus",
+            "modbus_port": modbus_port,
+            **(extra_config or {}),
+        }
+        with open(os.path.join(workdir, "config.json"), "w") as f:
+            json.dump(config, f)
+        log = open(os.path.join(workdir, "gateway.log"), "w")
+        try:
+            processes.append(subprocess.Popen(
+                [sys.executable, os.path.join(BENCH_DIR, "fake_shelly.py"), "--port", str(shelly_port), "--stamp",
+                 "--latency", str(latency), "--jitter", str(jitter), "--seed", "1"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            wait_for_port(shelly_port)
+            process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "main.py")],
+                                       cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+            processes.append(process)
+            wait_for_port(modbus_port)
+            time.sleep(2)  # Let the first polls go through
+            yield modbus_port, process
+        finally:
+            for process in reversed(processes):
+                process.send_signal(signal.SIGINT)
+                try:
+                    process.wait(5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8, help="concurrent Modbus load clients")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of each phase")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Shelly mean response delay")
+    parser.add_argument("--jitter", type=float, default=0.03, help="fake Shelly response delay variation")
+    parser.add_argument("--config", default="{}", help="extra gateway config as JSON")
+    args = parser.parse_args()
+
+    with gateway(json.loads(args.config), args.latency, args.jitter) as (modbus_port, process):
+        print(f"fake Shelly latency {args.latency * 1000:.0f} +/- {args.jitter * 1000:.0f} ms, "
+              f"{args.clients} load clients, {args.seconds:.0f} s per phase")
+        latencies, durations, cpu = run_phase(modbus_port, process.pid, 0, args.seconds)
+        report("Latency probe only", latencies, durations, cpu, args.seconds)
+        latencies, durations, cpu = run_phase(modbus_port, process.pid, args.clients, args.seconds)
+        report("Under load", latencies, durations, cpu, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Compare the precompiled RegisterEncoder with the per-value BinaryPayloadBuilder path.
+
+Run from the repository root:
+    python bench/bench_encoder.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pymodbus.constants import Endian
+from pymodbus.payload import BinaryPayloadBuilder
+
+from encoder import RegisterEncoder
+from register_mapping import map_values_to_registers
+from shelly_data import shelly_data
+
+NUMBER = 20000
+
+
+def float_to_registers(value):
+    builder = BinaryPayloadBuilder(byteorder=Endian.BIG, wordorder=Endian.BIG)
+    builder.add_32bit_float(value)
+    return builder.to_registers()
+
+
+def legacy_encode(modbus_data):
+    registers = [0] * 128
+    for address, value in modbus_data.items():
+        index = address - 72
+        register_values = float_to_registers(value)
+        registers[index] = register_values[0]
+        registers[index + 1] = register_values[1]
+    return registers
+
+
+def main():
+    modbus_data = map_values_to_registers(shelly_data(seed=1))
+    encoder = RegisterEncoder()
+
+    assert encoder.encode(modbus_data).tolist() == legacy_encode(modbus_data)
+
+    legacy = min(timeit.repeat(lambda: legacy_encode(modbus_data), number=NUMBER, repeat=5)) / NUMBER
+    compiled = min(timeit.repeat(lambda: encoder.encode(modbus_data), number=NUMBER, repeat=5)) / NUMBER
+    compiled_list = min(timeit.repeat(lambda: encoder.encode(modbus_data).tolist(), number=NUMBER, repeat=5)) / NUMBER
+
+    print(f"{len(modbus_data)} float32 values per image")
+    print(f"BinaryPayloadBuilder per value: {legacy * 1e6:8.2f} us/image")
+    print(f"RegisterEncoder:                {compiled * 1e6:8.2f} us/image ({legacy / compiled:.1f}x)")
+    print(f"RegisterEncoder + tolist():     {compiled_list * 1e6:8.2f} us/image ({legacy / compiled_list:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare the Shelly fetch modes: whole Shelly.GetStatus vs. EM.GetStatus + EMData.GetStatus.
+
+Starts a fake Shelly (bench/fake_shelly.py) as a subprocess and polls it with
+ShellyClient in both modes, reporting bytes per poll, fetch latency, JSON decode
+time and the CPU time the fake device spent per poll (Linux). Time is scaled down:
+polls are paced at --interval and EMData is refetched every 10 intervals, which is
+the default ratio of one poll per second and EMDATA_INTERVAL.
+
+Run from the repository root:
+    python bench/bench_fetch.py [--polls 500] [--interval 0.01] [--latency 0] [--jitter 0]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_e2e import cpu_seconds, free_port, percentile, wait_for_port
+from shelly import EMDATA_INTERVAL, ShellyClient
+
+
+async def measure(url, fetch, polls, interval, device_pid):
+    async with ShellyClient(url, fetch=fetch, emdata_interval=EMDATA_INTERVAL * interval) as shelly:
+        shelly.parse_em(await shelly.fetch_em())  # Warm up the connections
+        sizes, latencies, decodes = [], [], []
+        cpu_before = cpu_seconds(device_pid)
+        deadline = time.monotonic()
+        for _ in range(polls):
+            deadline += interval
+            await asyncio.sleep(max(0, deadline - time.monotonic()))
+            started = time.perf_counter()
+            bodies = await shelly.fetch_em()
+            fetched = time.perf_counter()
+            shelly.parse_em(bodies)
+            decodes.append(time.perf_counter() - fetched)
+            latencies.append(fetched - started)
+            sizes.append(sum(len(body) for body in bodies))
+        device_cpu = (cpu_seconds(device_pid) - cpu_before) / polls
+    return sizes, latencies, decodes, device_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--polls", type=int, default=500)
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between polls")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Shelly mean response delay")
+    parser.add_argument("--jitter", type=float, default=0.0, help="fake Shelly response delay variation")
+    args = parser.parse_args()
+
+    port = free_port()
+    device = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "fake_shelly.py"), "--port", str(port), "--seed", "1",
+         "--latency", str(args.latency), "--jitter", str(args.jitter)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        url = f"http://127.0.0.1:{port}/rpc/Shelly.GetStatus"
+        print(f"{args.polls} polls, fake Shelly latency {args.latency * 1000:.0f} +/- {args.jitter * 1000:.0f} ms")
+        for fetch in ("status", "components"):
+            sizes, latencies, decodes, device_cpu = asyncio.run(measure(url, fetch, args.polls, args.interval, device.pid))
+            print(f"\nfetch={fetch}")
+            print(f"  body size:        {statistics.mean(sizes):8.0f} bytes/poll")
+            print(f"  fetch latency:    p50 {percentile(latencies, 50) * 1000:6.2f} ms  p99 {percentile(latencies, 99) * 1000:6.2f} ms")
+            print(f"  JSON decode:      {statistics.median(decodes) * 1e6:8.1f} us/poll")
+            print(f"  device CPU:       {device_cpu * 1e6:8.0f} us/poll")
+    finally:
+        device.send_signal(signal.SIGINT)
+        try:
+            device.wait(5)
+        except subprocess.TimeoutExpired:
+            device.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""MQTT traffic of the gateway with and without deadband suppression.
+
+Runs the stand-in broker (fake_broker.py) in this process and, for each setting, a fake
+Shelly and the gateway (see bench_e2e.py) publishing to it, then reports messages and
+bytes per minute. It also merges the messages as a subscriber would and compares the
+merged values after every message with the sample the gateway recorded (record_file)
+at that time: none may be off by more than its deadband.
+
+Linux only. Run from the repository root:
+    python bench/bench_mqtt.py [--seconds 30] [--poll-interval 1]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_e2e import free_port, gateway
+from fake_broker import FakeBroker
+from mqtt import DEFAULT_DEADBANDS, deadbands
+from pipeline import OUTPUT_NAMES
+from recording import Recording
+
+NO_DEADBAND = {unit: 0 for unit in DEFAULT_DEADBANDS}
+
+
+def start_broker(port):
+    broker = FakeBroker()
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(broker.start(port))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return broker
+
+
+def check(received, recording, bands):
+    """Return (messages checked, messages with a merged quantity off by more than its deadband)."""
+    with Recording(recording) as samples:
+        truth = {round(record[0], 2): record[1:] for record in samples.records()}
+    merged = {}
+    checked, beyond = 0, 0
+    for _, _, payload, _ in received:
+        values = json.loads(payload)
+        merged.update(values)
+        sample = truth.get(values["t"])
+        if sample is None or len(merged) <= len(OUTPUT_NAMES):
+            continue
+        checked += 1
+        # The recording holds the served float32 values, the payload 7 digits of the same values
+        if any(abs(merged[name] - value) > band + 1e-6 * max(1, abs(value))
+               for name, value, band in zip(OUTPUT_NAMES, sample, bands)):
+            beyond += 1
+    return checked, beyond
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=30, help="duration of each run")
+    parser.add_argument("--poll-interval", type=float, default=1, help="gateway poll_interval")
+    args = parser.parse_args()
+
+    settings = [
+        ("full snapshot every interval", {"deadband": NO_DEADBAND, "full_interval": 1}),
+        ("changes only, no deadband", {"deadband": NO_DEADBAND}),
+        ("changes beyond default deadbands", {}),
+    ]
+    for label, mqtt in settings:
+        port = free_port()
+        broker = start_broker(port)
+        mqtt = {"host": "127.0.0.1", "port": port, "full_interval": 10, **mqtt}
+        with tempfile.TemporaryDirectory() as workdir:
+            recording = os.path.join(workdir, "samples.rec")
+            with gateway({"mqtt": mqtt, "poll_interval": args.poll_interval, "record_file": recording}):
+                broker.messages.clear()
+                started = time.monotonic()
+                time.sleep(args.seconds)
+                elapsed = time.monotonic() - started
+            checked, beyond = check(list(broker.received), recording, deadbands(mqtt.get("deadband", {})))
+        messages = sum(count for count, _ in broker.messages.values())
+        size = sum(size for _, size in broker.messages.values())
+        fields = sum(len(json.loads(payload)) - 1 for _, _, payload, _ in broker.received[-messages:])
+        print(f"\n{label}")
+        print(f"  messages:           {messages * 60 / elapsed:8.1f} per minute")
+        print(f"  bytes:              {size * 60 / elapsed:8.0f} per minute")
+        print(f"  quantities:         {fields / max(messages, 1):8.1f} per message")
+        print(f"  beyond deadband:    {beyond} of {checked} merged messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Compare the compiled TransformPipeline with remove_offsets/nullify_channel/map_values_to_registers.
+
+Checks that both produce the same register image for many samples, offsets and
+every nullify_channel combination, then measures throughput of both paths.
+
+Run from the repository root:
+    python bench/bench_pipeline.py
+"""
+import itertools
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from encoder import RegisterEncoder
+from meter import OFFSET_KEYS
+from pipeline import TransformPipeline
+from register_mapping import map_values_to_registers
+from shelly_data import MeterSimulator
+
+NUMBER = 20000
+CHANNEL_SETS = [list(c) for n in range(3) for c in itertools.combinations("abc", n)]
+
+
+def remove_offsets(data, offsets):
+    """The original per-sample offset removal, reference for TransformPipeline"""
+    data["a_total_act_energy"] -= offsets['a_total_act_energy']
+    data["a_total_act_ret_energy"] -= offsets['a_total_act_ret_energy']
+    data["b_total_act_energy"] -= offsets['b_total_act_energy']
+    data["b_total_act_ret_energy"] -= offsets['b_total_act_ret_energy']
+    data["c_total_act_energy"] -= offsets['c_total_act_energy']
+    data["c_total_act_ret_energy"] -= offsets['c_total_act_ret_energy']
+    data["total_act"] -= offsets['total_act']
+    data["total_act_ret"] -= offsets['total_act_ret']
+    return data
+
+
+def nullify_channel(data, channels):
+    """Remove data from a shelly channel, if it is not used by an inverter"""
+    # Validate the channel parameter
+    for channel in channels:
+        if channel not in ['a', 'b', 'c']:
+            raise ValueError("Channel must be 'a', 'b', or 'c'.")
+
+        # Nullify the specified channel in 'em:0'
+        for key in list(data.keys()):
+            if key.startswith(f'{channel}_') and key not in [f'{channel}_freq', f'{channel}_voltage']:
+                data[key] = 0 if isinstance(data[key], (int, float)) else None
+
+        # Recalculate total values
+        active_channels = [ch for ch in ['a', 'b', 'c'] if ch != channel]
+        data['total_current'] = sum(data[f'{ch}_current'] for ch in active_channels)
+        data['total_act_power'] = sum(data[f'{ch}_act_power'] for ch in active_channels)
+        data['total_aprt_power'] = sum(data[f'{ch}_aprt_power'] for ch in active_channels)
+
+        data['total_act'] = sum(data[f'{ch}_total_act_energy'] for ch in active_channels)
+        data['total_act_ret'] = sum(data[f'{ch}_total_act_ret_energy'] for ch in active_channels)
+
+
+def legacy_image(encoder, data, offsets, channels):
+    data = dict(data)
+    remove_offsets(data, offsets)
+    nullify_channel(data, channels)
+    return encoder.encode(map_values_to_registers(data)).tolist()
+
+
+def check_equivalence(encoder, samples=500):
+    rng = random.Random(2)
+    meter = MeterSimulator(seed=2)
+    for _ in range(samples):
+        meter.step(rng.uniform(0.1, 30))
+        data = {**meter.em_status(), **meter.emdata_status()}
+        offsets = {key: rng.uniform(0, data[key]) for key in OFFSET_KEYS}
+        for channels in CHANNEL_SETS:
+            pipeline = TransformPipeline(offsets, channels, encoder)
+            expected = legacy_image(encoder, data, offsets, channels)
+            assert encoder.encode_values(pipeline.run(data)).tolist() == expected, (channels, data)
+    return samples * len(CHANNEL_SETS)
+
+
+def main():
+    encoder = RegisterEncoder()
+    checked = check_equivalence(encoder)
+    print(f"{checked} samples identical to the legacy path")
+
+    meter = MeterSimulator(seed=1)
+    data = {**meter.em_status(), **meter.emdata_status()}
+    offsets = {key: data[key] / 2 for key in OFFSET_KEYS}
+    for channels in ([], ["c"]):
+        pipeline = TransformPipeline(offsets, channels, encoder)
+        legacy = min(timeit.repeat(lambda: legacy_image(encoder, data, offsets, channels),
+                                   number=NUMBER, repeat=5)) / NUMBER
+        compiled = min(timeit.repeat(lambda: encoder.encode_values(pipeline.run(data)).tolist(),
+                                     number=NUMBER, repeat=5)) / NUMBER
+        print(f"nullify_channel={channels}")
+        print(f"  legacy transform + map + encode: {legacy * 1e6:8.2f} us/sample ({1 / legacy:9,.0f} samples/s)")
+        print(f"  TransformPipeline + encode:      {compiled * 1e6:8.2f} us/sample ({1 / compiled:9,.0f} samples/s, "
+              f"{legacy / compiled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Size and speed of sample recordings.
+
+Records one day of 1 Hz samples, then measures reading the records and a single
+column in place from the memory map, replay() at maximum speed and replaying
+into gather + encode.
+
+Run from the repository root:
+    python bench/bench_recording.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from encoder import RegisterEncoder
+from meter import OFFSET_KEYS
+from pipeline import TransformPipeline, derive
+from recording import Recorder, Recording, replay
+from shelly_data import MeterSimulator
+
+SAMPLES = 86400
+
+
+async def replay_all(path):
+    count = 0
+    async for timestamp, values in replay(path, speed=0):
+        count += 1
+    return count
+
+
+async def replay_encode(path, pipeline, encoder):
+    count = 0
+    async for timestamp, values in replay(path, speed=0):
+        encoder.encode_values(pipeline.gather(values + (0.0,)))
+        count += 1
+    return count
+
+
+def rate(count, seconds):
+    return f"{count / seconds:12,.0f} samples/s"
+
+
+def main():
+    meter = MeterSimulator(seed=1)
+    encoder = RegisterEncoder()
+    pipeline = TransformPipeline({key: 0 for key in OFFSET_KEYS}, [], encoder)
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "day.rec")
+        recorder = Recorder(path)
+        timestamp = time.time()
+        started = time.perf_counter()
+        for i in range(SAMPLES):
+            meter.step(1.0)
+            recorder.append(timestamp + i, derive(pipeline.measure({**meter.em_status(), **meter.emdata_status()})))
+        recorder.close()
+        print(f"one day at 1 Hz: {SAMPLES} records, {os.path.getsize(path) / 1e6:.1f} MB "
+              f"({Recording(path).record.size} bytes/record)")
+        print(f"simulate + transform + record: {rate(SAMPLES, time.perf_counter() - started)}")
+
+        with Recording(path) as recording:
+            started = time.perf_counter()
+            count = sum(1 for _ in recording.records())
+            print(f"read records from the map:     {rate(count, time.perf_counter() - started)}")
+            started = time.perf_counter()
+            count = sum(1 for _ in recording.column("W"))
+            print(f"read column W from the map:    {rate(count, time.perf_counter() - started)}")
+
+        started = time.perf_counter()
+        count = asyncio.run(replay_all(path))
+        print(f"replay(speed=0):               {rate(count, time.perf_counter() - started)}")
+
+        started = time.perf_counter()
+        count = asyncio.run(replay_encode(path, pipeline, encoder))
+        print(f"replay + gather + encode:      {rate(count, time.perf_counter() - started)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Gateway with and without the encoded response cache under several Modbus clients.
+
+First measures the request handling alone, in process: executing a read of
+40072-40195 against the datastore and framing the response, default pymodbus
+request vs. CachedReadHoldingRegistersRequest, and checks both frames are equal.
+
+Then, for each setting, starts a fake Shelly and the gateway (see bench_e2e.py) and runs
+  1. --clients clients each reading 40001-40195 (two requests) --rate times per second,
+  2. the same clients reading as fast as they can,
+reporting request latency and gateway CPU per request.
+
+Linux only. Run from the repository root:
+    python bench/bench_response_cache.py [--clients 8] [--rate 5] [--seconds 10]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from pymodbus.framer import FramerSocket
+from pymodbus.pdu.decoders import DecodePDU
+from pymodbus.pdu.register_message import ReadHoldingRegistersRequest
+
+from bench_e2e import gateway, report, run_phase
+from modbus import CachedReadHoldingRegistersRequest, initialize_datablock_and_context
+
+NUMBER = 20000
+
+
+async def handle(request_class, context, framer, number=NUMBER):
+    """Return the seconds per request and the response frame."""
+    request = request_class(address=71, count=124, dev_id=1, transaction_id=1)
+    started = time.perf_counter()
+    for _ in range(number):
+        frame = framer.buildFrame(await request.update_datastore(context))
+    return (time.perf_counter() - started) / number, frame
+
+
+def measure_handling():
+    datablocks, context = initialize_datablock_and_context()
+    framer = FramerSocket(DecodePDU(True))
+    default, expected = asyncio.run(handle(ReadHoldingRegistersRequest, context[0], framer))
+    cached, frame = asyncio.run(handle(CachedReadHoldingRegistersRequest, context[0], framer))
+    assert frame == expected
+    print("request handling, 124 registers:")
+    print(f"  pymodbus request:    {default * 1e6:6.1f} us")
+    print(f"  cached request:      {cached * 1e6:6.1f} us ({default / cached:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8, help="concurrent Modbus clients")
+    parser.add_argument("--rate", type=float, default=5, help="reads of both blocks per second and client in the paced phase")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of each phase")
+    args = parser.parse_args()
+
+    measure_handling()
+    for response_cache in (False, True):
+        with gateway({"response_cache": response_cache}) as (modbus_port, process):
+            print(f"\n=== response_cache {response_cache}")
+            latencies, durations, cpu = run_phase(modbus_port, process.pid, args.clients, args.seconds, args.rate)
+            report(f"{args.clients} clients x {args.rate * 2:.0f} requests/s", latencies, durations, cpu, args.seconds)
+            latencies, durations, cpu = run_phase(modbus_port, process.pid, args.clients, args.seconds)
+            report(f"{args.clients} clients, unpaced", latencies, durations, cpu, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Cost of WindowSmoother per sample for every method and a few window sizes.
+
+Run from the repository root:
+    python bench/bench_smoothing.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from encoder import RegisterEncoder
+from meter import OFFSET_KEYS
+from pipeline import TransformPipeline
+from shelly_data import MeterSimulator
+from smoothing import SMOOTHING_METHODS, WindowSmoother
+
+NUMBER = 5000
+SAMPLES = 64
+
+
+def main():
+    meter = MeterSimulator(seed=1)
+    pipeline = TransformPipeline({key: 0 for key in OFFSET_KEYS}, [], RegisterEncoder())
+    samples = []
+    for _ in range(SAMPLES):
+        meter.step(0.1)
+        samples.append(pipeline.run({**meter.em_status(), **meter.emdata_status()}))
+
+    print(f"{len(pipeline.instantaneous)} smoothed values per sample")
+    for window in (5, 10, 50):
+        for method in SMOOTHING_METHODS:
+            smoother = WindowSmoother(method, window, pipeline.instantaneous)
+            for values in samples:
+                smoother.add(values)
+            seconds = min(timeit.repeat(lambda: [smoother.add(values) for values in samples],
+                                        number=NUMBER // SAMPLES, repeat=5)) / (NUMBER // SAMPLES * SAMPLES)
+            print(f"window {window:3d} {method:6s}: {seconds * 1e6:7.1f} us/sample")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""Modbus read throughput of the gateway with 0 (in-process server) to N server workers.
+
+For each worker count, starts a fake Shelly and the gateway (see bench_e2e.py) and
+lets --clients processes read 40001-40195 as fast as they can. Throughput can only
+grow with the workers on a machine with spare cores for them.
+
+Linux only. Run from the repository root:
+    python bench/bench_workers.py [--workers 0 1 2 4] [--clients 16] [--seconds 10]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_e2e import gateway, report, run_phase
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="server_workers settings to compare")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent Modbus clients")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of each run")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.clients} clients")
+    for workers in args.workers:
+        with gateway({"server_workers": workers}) as (modbus_port, process):
+            latencies, durations, cpu = run_phase(modbus_port, process.pid, args.clients, args.seconds)
+            report(f"server_workers {workers}", latencies, durations, cpu, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Local stand-in for an MQTT broker.
+
+Speaks enough MQTT 3.1.1 at QoS 0 for the gateway's publisher and simple subscribers:
+CONNECT, PUBLISH (with retained messages), SUBSCRIBE with + and # wildcards, PINGREQ
+and DISCONNECT. Counts the received messages and bytes per topic.
+    python bench/fake_broker.py --port 1883 --print
+and set "mqtt": {"host": "127.0.0.1"} in config.json.
+"""
+import argparse
+import asyncio
+import struct
+import time
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(levels) or (level != "+" and level != levels[i]):
+            return False
+    return len(filter_levels) == len(levels)
+
+
+async def read_packet(reader):
+    header = (await reader.readexactly(1))[0]
+    length, shift = 0, 0
+    while True:
+        digit = (await reader.readexactly(1))[0]
+        length |= (digit & 0x7F) << shift
+        shift += 7
+        if not digit & 0x80:
+            break
+    return header, await reader.readexactly(length)
+
+
+class FakeBroker:
+    def __init__(self, echo=False):
+        self.echo = echo
+        self.subscriptions = {}  # writer -> [topic filters]
+        self.retained = {}
+        self.messages = {}  # topic -> [count, bytes of the PUBLISH packets]
+        self.received = []  # (time, topic, payload, retain) of every PUBLISH
+
+    async def start(self, port, host="127.0.0.1"):
+        return await asyncio.start_server(self.handle, host, port)
+
+    def deliver(self, topic, packet):
+        for writer, filters in self.subscriptions.items():
+            if any(topic_matches(topic_filter, topic) for topic_filter in filters):
+                writer.write(packet)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                kind = header >> 4
+                if kind == 1:  # CONNECT
+                    writer.write(b"\x20\x02\x00\x00")
+                elif kind == 3:  # PUBLISH, QoS 0
+                    length = struct.unpack_from(">H", body)[0]
+                    topic = body[2:2 + length].decode()
+                    payload = body[2 + length:]
+                    retain = bool(header & 1)
+                    stats = self.messages.setdefault(topic, [0, 0])
+                    stats[0] += 1
+                    stats[1] += 1 + len(self.encode_length(len(body))) + len(body)
+                    self.received.append((time.time(), topic, payload, retain))
+                    if self.echo:
+                        print(f"{topic}{' (retained)' if retain else ''}: {payload.decode(errors='replace')}")
+                    if retain:
+                        self.retained[topic] = payload
+                    self.deliver(topic, bytes((header & 0xFE,)) + self.encode_length(len(body)) + body)
+                elif kind == 8:  # SUBSCRIBE
+                    packet_id = body[:2]
+                    filters = []
+                    position = 2
+                    while position < len(body):
+                        length = struct.unpack_from(">H", body, position)[0]
+                        filters.append(body[position + 2:position + 2 + length].decode())
+                        position += 3 + length
+                    self.subscriptions.setdefault(writer, []).extend(filters)
+                    writer.write(b"\x90" + self.encode_length(2 + len(filters)) + packet_id + bytes(len(filters)))
+                    for topic, payload in self.retained.items():
+                        if any(topic_matches(topic_filter, topic) for topic_filter in filters):
+                            publish = struct.pack(">H", len(topic.encode())) + topic.encode() + payload
+                            writer.write(b"\x31" + self.encode_length(len(publish)) + publish)
+                elif kind == 12:  # PINGREQ
+                    writer.write(b"\xd0\x00")
+                elif kind == 14:  # DISCONNECT
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscriptions.pop(writer, None)
+            writer.close()
+
+    @staticmethod
+    def encode_length(length):
+        encoded = bytearray()
+        while True:
+            length, digit = divmod(length, 128)
+            encoded.append(digit | 0x80 if length else digit)
+            if not length:
+                return bytes(encoded)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--print", action="store_true", help="print every published message")
+    args = parser.parse_args()
+    server = await FakeBroker(echo=args.print).start(args.port, args.host)
+    print(f"Fake MQTT broker on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
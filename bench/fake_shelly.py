@@ -0,0 +1,124 @@
+"""Local stand-in for a Shelly Pro 3EM.
+
+Serves Shelly.GetStatus, EM.GetStatus and EMData.GetStatus over HTTP and the
+/rpc WebSocket with NotifyStatus events, so the gateway can be run and measured without hardware:
+    python bench/fake_shelly.py --port 8080
+and point shelly_url at http://127.0.0.1:8080/rpc/Shelly.GetStatus.
+
+With --stamp, a_voltage carries the wall-clock second within the minute at which
+the response was sent, so a Modbus client reading PhVphA (40082) can tell how long
+a sample took to become visible.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web, WSMsgType
+
+from shelly_data import MeterSimulator
+
+
+class FakeShelly:
+    def __init__(self, notify_interval=1.0, ws_drop_after=0, latency=0.0, jitter=0.0, stamp=False, seed=None):
+        self.meter = MeterSimulator(seed)
+        self.notify_interval = notify_interval
+        self.ws_drop_after = ws_drop_after
+        self.latency = latency
+        self.jitter = jitter
+        self.stamp = stamp
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.app = web.Application()
+        self.app.router.add_get("/rpc/Shelly.GetStatus", self.handle_get_status)
+        self.app.router.add_get("/rpc/EM.GetStatus", self.handle_em_get_status)
+        self.app.router.add_get("/rpc/EMData.GetStatus", self.handle_emdata_get_status)
+        self.app.router.add_get("/rpc", self.handle_websocket)
+        self.app.on_startup.append(self.start_meter)
+        self.app.on_cleanup.append(self.stop_meter)
+        self.changed = asyncio.Event()
+
+    async def start_meter(self, app):
+        self.meter_task = asyncio.create_task(self.run_meter())
+
+    async def stop_meter(self, app):
+        self.meter_task.cancel()
+
+    async def run_meter(self):
+        while True:
+            await asyncio.sleep(self.notify_interval)
+            self.meter.step(self.notify_interval)
+            self.changed.set()
+            self.changed = asyncio.Event()
+
+    def em_status(self):
+        em = self.meter.em_status()
+        if self.stamp:
+            em["a_voltage"] = time.time() % 60
+        return em
+
+    def status(self):
+        return {**self.meter.status(), "em:0": self.em_status()}
+
+    async def respond_delay(self):
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def handle_get_status(self, request):
+        self.requests += 1
+        await self.respond_delay()
+        return web.json_response(self.status())
+
+    async def handle_em_get_status(self, request):
+        self.requests += 1
+        await self.respond_delay()
+        return web.json_response(self.em_status())
+
+    async def handle_emdata_get_status(self, request):
+        self.requests += 1
+        await self.respond_delay()
+        return web.json_response(self.meter.emdata_status())
+
+    async def handle_websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        src = None
+        msg = await ws.receive()
+        if msg.type == WSMsgType.TEXT:
+            frame = json.loads(msg.data)
+            src = frame.get("src")
+            result = self.status() if frame.get("method") == "Shelly.GetStatus" else {}
+            await ws.send_str(json.dumps({"id": frame.get("id"), "src": "shellypro3em-fake", "dst": src, "result": result}))
+
+        sent = 0
+        while not ws.closed and src is not None:
+            await self.changed.wait()
+            params = {"ts": time.time(), "em:0": self.em_status(), "emdata:0": self.meter.emdata_status()}
+            await ws.send_str(json.dumps({"src": "shellypro3em-fake", "dst": src, "method": "NotifyStatus", "params": params}))
+            sent += 1
+            if self.ws_drop_after and sent >= self.ws_drop_after:
+                break
+        await ws.close()
+        return ws
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--notify-interval", type=float, default=1.0, help="seconds between NotifyStatus events")
+    parser.add_argument("--ws-drop-after", type=int, default=0, help="close each WebSocket after N events (0: never)")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean HTTP response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- variation of the response delay in seconds")
+    parser.add_argument("--stamp", action="store_true", help="put the send time into a_voltage")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    fake = FakeShelly(args.notify_interval, args.ws_drop_after, args.latency, args.jitter, args.stamp, args.seed)
+    web.run_app(fake.app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
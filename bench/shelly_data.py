@@ -0,0 +1,85 @@
+"""Synthetic Shelly Pro 3EM documents for benchmarks and the fake device."""
+import random
+import time
+
+
+class MeterSimulator:
+    """Random-walk three phase meter with energy counters integrating the power."""
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.voltage = {p: self.rng.uniform(226.0, 234.0) for p in "abc"}
+        self.act_power = {p: self.rng.uniform(-2500.0, 2500.0) for p in "abc"}
+        self.reactive = {p: self.rng.uniform(10.0, 200.0) for p in "abc"}
+        self.act_energy = {p: self.rng.uniform(1e6, 2e6) for p in "abc"}
+        self.ret_energy = {p: self.rng.uniform(1e5, 1e6) for p in "abc"}
+        self.freq = 50.0
+
+    def step(self, dt=1.0):
+        rng = self.rng
+        for p in "abc":
+            self.voltage[p] = min(max(self.voltage[p] + rng.gauss(0, 0.3), 220.0), 240.0)
+            self.act_power[p] = min(max(self.act_power[p] + rng.gauss(0, 40.0), -4000.0), 4000.0)
+            self.reactive[p] = min(max(self.reactive[p] + rng.gauss(0, 5.0), 0.0), 500.0)
+            if self.act_power[p] >= 0:
+                self.act_energy[p] += self.act_power[p] * dt / 3600
+            else:
+                self.ret_energy[p] -= self.act_power[p] * dt / 3600
+        self.freq = min(max(self.freq + rng.gauss(0, 0.005), 49.9), 50.1)
+
+    def em_status(self):
+        em = {"id": 0}
+        for p in "abc":
+            aprt_power = abs(self.act_power[p]) + self.reactive[p]
+            em.update({
+                f"{p}_current": round(aprt_power / self.voltage[p], 3),
+                f"{p}_voltage": round(self.voltage[p], 1),
+                f"{p}_act_power": round(self.act_power[p], 1),
+                f"{p}_aprt_power": round(aprt_power, 1),
+                f"{p}_pf": round(abs(self.act_power[p]) / aprt_power, 2),
+                f"{p}_freq": round(self.freq, 2),
+            })
+        em["n_current"] = None
+        em["total_current"] = round(sum(em[f"{p}_current"] for p in "abc"), 3)
+        em["total_act_power"] = round(sum(em[f"{p}_act_power"] for p in "abc"), 3)
+        em["total_aprt_power"] = round(sum(em[f"{p}_aprt_power"] for p in "abc"), 3)
+        em["user_calibrated_phase"] = []
+        return em
+
+    def emdata_status(self):
+        emdata = {"id": 0}
+        for p in "abc":
+            emdata[f"{p}_total_act_energy"] = round(self.act_energy[p], 2)
+            emdata[f"{p}_total_act_ret_energy"] = round(self.ret_energy[p], 2)
+        emdata["total_act"] = round(sum(self.act_energy.values()), 2)
+        emdata["total_act_ret"] = round(sum(self.ret_energy.values()), 2)
+        return emdata
+
+    def status(self):
+        """Return a full Shelly.GetStatus document as a Pro 3EM would send it."""
+        now = int(time.time())
+        return {
+            "ble": {},
+            "cloud": {"connected": True},
+            "em:0": self.em_status(),
+            "emdata:0": self.emdata_status(),
+            "eth": {"ip": None},
+            "modbus": {},
+            "mqtt": {"connected": False},
+            "sys": {
+                "mac": "A0A3B3000000", "restart_required": False, "time": time.strftime("%H:%M"),
+                "unixtime": now, "uptime": 123456, "ram_size": 246284, "ram_free": 115532,
+                "fs_size": 524288, "fs_free": 196608, "cfg_rev": 21, "kvs_rev": 1,
+                "schedule_rev": 0, "webhook_rev": 0,
+                "available_updates": {"stable": {"version": "1.4.4"}},
+            },
+            "temperature:0": {"id": 0, "tC": 41.2, "tF": 106.2},
+            "wifi": {"sta_ip": "192.168.1.50", "status": "got ip", "ssid": "gateway", "rssi": -61},
+            "ws": {"connected": False},
+        }
+
+
+def shelly_data(seed=None):
+    """Return merged 'em:0' and 'emdata:0' components of a random meter."""
+    meter = MeterSimulator(seed)
+    return {**meter.em_status(), **meter.emdata_status()}
@@ -0,0 +1,57 @@
+import struct
+import sys
+from array import array
+
+from register_mapping import registers
+
+IMAGE_START = 72
+IMAGE_LENGTH = 128
+
+
+class RegisterEncoder:
+    """Encodes mapped meter values into the float32 register image.
+
+    The layout is compiled once from the register map: every float32 register
+    inside the image gets a slot in a single big-endian struct, gaps are padding.
+    Encoding is one pack_into() into a reused word buffer.
+    """
+
+    def __init__(self, start=IMAGE_START, length=IMAGE_LENGTH, register_map=registers):
+        self.start = start
+        self.length = length
+
+        fmt = ">"
+        position = start
+        self.slots = {}
+        for reg in sorted(register_map, key=lambda r: r["address"]):
+            if reg["type"] != "float32":
+                continue
+            if reg["address"] < start or reg["address"] + 2 > start + length:
+                continue
+            fmt += "x" * 2 * (reg["address"] - position) + "f"
+            self.slots[reg["address"]] = len(self.slots)
+            position = reg["address"] + 2
+        fmt += "x" * 2 * (start + length - position)
+
+        self.struct = struct.Struct(fmt)
+        self.values = [0.0] * len(self.slots)
+        self.zeros = [0.0] * len(self.slots)
+        self.words = array("H", [0]) * length
+        self.raw = memoryview(self.words).cast("B")
+        self.swap = sys.byteorder == "little"
+
+    def encode(self, modbus_data):
+        """Encode {address: value} and return the reused register buffer."""
+        values = self.values
+        values[:] = self.zeros
+        slots = self.slots
+        for address, value in modbus_data.items():
+            values[slots[address]] = value
+        return self.encode_values(values)
+
+    def encode_values(self, values):
+        """Encode one value per slot, in slot order, and return the reused register buffer."""
+        self.struct.pack_into(self.raw, 0, *values)
+        if self.swap:
+            self.words.byteswap()
+        return self.words
@@ -1,24 +1,32 @@
 import os
-import threading
-import time
+import asyncio
+import contextlib
+import copy
 import datetime
+import functools
 
-import requests
-from pymodbus.constants import Endian
-from pymodbus.payload import BinaryPayloadBuilder
-from pymodbus.server import StartTcpServer, ServerStop
-from pymodbus.server.base import ModbusBaseServer
+from pymodbus.server import ModbusTcpServer
 
-from register_mapping import map_values_to_registers
-from modbus import initialize_datablock_and_context
+from encoder import IMAGE_LENGTH, IMAGE_START
+from modbus import CACHED_REQUESTS, initialize_datablock_and_context
+from mqtt import MqttPublisher
+from meter import RELOADABLE_KEYS, Meter
+from recording import replay
+from scheduler import POLL_INTERVAL, PollScheduler
+from shared import WorkerPool
+from state import STATE_FILE, StatePersister
 
 import json
 import signal
-import sys
+import time
+
+import metrics
 
 MODBUS_PORT = 502
+WEBSOCKET_RETRY_DELAY = 30
 CONFIG_FILE = "config.json"
-DEFAULT_CONFIG = {
+DEFAULT_METER = {
+    "unit_id": None,
     "shelly_url": "http://shelly/rpc/Shelly.GetStatus",
     "offsets": {
         "a_total_act_energy": 0,
@@ -30,155 +38,297 @@ DEFAULT_CONFIG = {
         "total_act": 0,
         "total_act_ret": 0
     },
-    "nullify_channel": []
+    "nullify_channel": [],
+    "ingestion": "poll",
+    "fetch": "status",
+    "smoothing": None,
+    "record_file": None,
+    "replay": None
 }
+DEFAULT_CONFIG = {**DEFAULT_METER, "poll_interval": POLL_INTERVAL, "modbus_port": MODBUS_PORT, "response_cache": True, "server_workers": 0, "metrics_port": None, "state_file": STATE_FILE, "mqtt": None}
+
+CONFIG_CHECK_INTERVAL = 2  # Seconds between checks whether config.json changed
+RELOADABLE_CONFIG = ("poll_interval",)  # Top-level settings a reload applies, besides meter.RELOADABLE_KEYS
 
-if os.path.exists(CONFIG_FILE):
-    with open(CONFIG_FILE) as f:
-        config = json.load(f)
-else:
-    print("⚠️  Warning: No config.json found, using defaults!")
-    config = DEFAULT_CONFIG
-
-lock = threading.Lock()
-shelly_thread = None
-shutdown_event = threading.Event()
-
-def remove_offsets(data):
-    data["a_total_act_energy"] -= config['offsets']['a_total_act_energy']
-    data["a_total_act_ret_energy"] -= config['offsets']['a_total_act_ret_energy']
-    data["b_total_act_energy"] -= config['offsets']['b_total_act_energy']
-    data["b_total_act_ret_energy"] -= config['offsets']['b_total_act_ret_energy']
-    data["c_total_act_energy"] -= config['offsets']['c_total_act_energy']
-    data["c_total_act_ret_energy"] -= config['offsets']['c_total_act_ret_energy']
-    data["total_act"] -= config['offsets']['total_act']
-    data["total_act_ret"] -= config['offsets']['total_act_ret']
-    return data
-
-def nullify_channel(data):
-    """Remove data from a shelly channel, if it is not used by an inverter"""
-    # Validate the channel parameter
-    for channel in config['nullify_channel']:
-        if channel not in ['a', 'b', 'c']:
-            raise ValueError("Channel must be 'a', 'b', or 'c'.")
-
-        # Nullify the specified channel in 'em:0'
-        for key in list(data.keys()):
-            if key.startswith(f'{channel}_') and key not in [f'{channel}_freq', f'{channel}_voltage']:
-                data[key] = 0 if isinstance(data[key], (int, float)) else None
-
-        # Recalculate total values
-        active_channels = [ch for ch in ['a', 'b', 'c'] if ch != channel]
-        data['total_current'] = sum(data[f'{ch}_current'] for ch in active_channels)
-        data['total_act_power'] = sum(data[f'{ch}_act_power'] for ch in active_channels)
-        data['total_aprt_power'] = sum(data[f'{ch}_aprt_power'] for ch in active_channels)
-
-        data['total_act'] = sum(data[f'{ch}_total_act_energy'] for ch in active_channels)
-        data['total_act_ret'] = sum(data[f'{ch}_total_act_ret_energy'] for ch in active_channels)
-
-
-def read_shelly():
-    response = requests.get(config['shelly_url'], timeout=5)
-    response.raise_for_status()
-    data = response.json()
-    shelly_data = {**data['em:0'], **data['emdata:0']}
-    remove_offsets(shelly_data)
-    nullify_channel(shelly_data)
-
-    return shelly_data
-
-
-def float_to_registers(value):
-    """Convert a float to a Modbus registers using BinaryPayloadBuilder."""
-    builder = BinaryPayloadBuilder(byteorder=Endian.BIG, wordorder=Endian.BIG)
-    builder.add_32bit_float(value)
-    payload = builder.to_registers()  # Convert the payload to 16-bit registers
-    return payload
-
-def update_context(context):
-    shelly_data = read_shelly()
-    modbus_data = map_values_to_registers(shelly_data)
-
-    registers = [0] * 128
-    start_address = 72
-    for address, value in modbus_data.items():
-        index = address - start_address
-        register_values = float_to_registers(value)
-        registers[index] = register_values[0]
-        registers[index + 1] = register_values[1]
-    context[0].setValues(3,72-1, registers)
-    return context
-
-def start_modbus_server(context):
-    print(f"{datetime.datetime.now()}: ### Starting Shelly-Fronius-Gateway on port {MODBUS_PORT}")
-    try:
-        StartTcpServer(context=context, address=("0.0.0.0", MODBUS_PORT))
-    except TimeoutError:
-        print(f"{datetime.datetime.now()}: MODBUS server timeout") #Happens on SIGTERM / SIGINT
-    except Exception as e:
-        print(f"{datetime.datetime.now()}: MODBUS server failed: {e}")
 
-def update_data_periodically(context):
-    while not shutdown_event.is_set():
-        time_to_wait = 1
+def load_config(path=CONFIG_FILE):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    print("⚠️  Warning: No config.json found, using defaults!")
+    return DEFAULT_CONFIG
+
+
+config = load_config()
+
+
+def meter_settings(config):
+    """Return one settings dict per meter.
+
+    A config without "meters" describes a single meter answering on every unit ID. With
+    "meters", each entry needs its own "unit_id"; top-level keys are defaults for all entries.
+    """
+    defaults = {key: value for key, value in config.items() if key in DEFAULT_METER}
+    if 'meters' not in config:
+        entries = [{"unit_id": None}]
+    else:
+        entries = config['meters']
+        if not entries:
+            raise ValueError("'meters' must list at least one meter.")
+
+    meters = []
+    for entry in entries:
+        settings = copy.deepcopy({**DEFAULT_METER, **defaults, **entry})
+        if 'meters' in config and not isinstance(settings['unit_id'], int):
+            raise ValueError(f"Meter {entry} needs an integer 'unit_id'.")
+        for channel in settings['nullify_channel']:
+            if channel not in ['a', 'b', 'c']:
+                raise ValueError("Channel must be 'a', 'b', or 'c'.")
+        if settings['ingestion'] not in ['poll', 'websocket']:
+            raise ValueError("ingestion must be 'poll' or 'websocket'.")
+        if settings['fetch'] not in ['status', 'components']:
+            raise ValueError("fetch must be 'status' or 'components'.")
+        settings.setdefault('name', "shelly" if settings['unit_id'] is None else f"unit {settings['unit_id']}")
+        meters.append(settings)
+
+    unit_ids = [settings['unit_id'] for settings in meters]
+    if len(set(unit_ids)) != len(unit_ids):
+        raise ValueError(f"Duplicate unit_id in meters: {unit_ids}")
+    record_files = [settings['record_file'] for settings in meters if settings['record_file']]
+    if len(set(record_files)) != len(record_files):
+        raise ValueError(f"Every meter needs its own record_file: {record_files}")
+    return meters
+
+
+def poll_interval(config):
+    """Return the configured poll_interval, raising ValueError unless it is a positive number."""
+    interval = config.get('poll_interval', POLL_INTERVAL)
+    if not isinstance(interval, (int, float)) or interval <= 0:
+        raise ValueError("poll_interval must be a positive number")
+    return interval
+
+
+async def start_modbus_server(context, port=MODBUS_PORT, response_cache=True):
+    print(f"{datetime.datetime.now()}: ### Starting Shelly-Fronius-Gateway on port {port}")
+    server = ModbusTcpServer(context=context, address=("0.0.0.0", port), trace_pdu=metrics.trace_pdu,
+                             custom_pdu=CACHED_REQUESTS if response_cache else None)
+    await server.serve_forever(background=True)
+    return server
+
+
+async def update_data_from_websocket(meter, scheduler):
+    """Update the registers from pushed NotifyStatus events, polling over HTTP while the socket is down."""
+    while True:
         try:
-            update_context(context)
+            meter.log(f"Connecting to Shelly WebSocket {meter.shelly.ws_url}")
+            async for shelly_data in meter.shelly.watch_em():
+                try:
+                    meter.update_registers(shelly_data)
+                except Exception as e:
+                    meter.log(f"Failed to update data: {e}")
+                    metrics.poll_failures.inc(meter.name)
         except Exception as e:
-            print(f"{datetime.datetime.now()}: Failed to update data: {e}")
-            time_to_wait = 2 #Sleep a bit longer after an error
-        time.sleep(time_to_wait)
-
-
-def handle_signal(sig, frame):
-    """Handle SIGTERM and SIGINT (Ctrl+C)."""
-    print(f"{datetime.datetime.now()}: Received signal {sig}, shutting down...")
-    shutdown_event.set()
-    time.sleep(2) #wait for cleanup
-    if shelly_thread and shelly_thread.is_alive():
-        shelly_thread.join()  # Ensure the thread stops
-        print(f"{datetime.datetime.now()}: Shelly Thread stopped, exiting")
-    sys.exit(0)
-
-def set_offsets_on_startup():
-    response = requests.get(config['shelly_url'])
-    response.raise_for_status()
-    data = response.json()
-    shelly_data = {**data['em:0'], **data['emdata:0']}
-    print(f"Old offsets: {config['offsets']}")
-    config['offsets']['a_total_act_energy'] = shelly_data["a_total_act_energy"]
-    config['offsets']['a_total_act_ret_energy'] = shelly_data["a_total_act_ret_energy"]
-    config['offsets']['b_total_act_energy'] = shelly_data["b_total_act_energy"]
-    config['offsets']['b_total_act_ret_energy'] = shelly_data["b_total_act_ret_energy"]
-    config['offsets']['c_total_act_energy'] = shelly_data["c_total_act_energy"]
-    config['offsets']['c_total_act_ret_energy'] = shelly_data["c_total_act_ret_energy"]
-    config['offsets']['total_act'] = shelly_data["total_act"]
-    config['offsets']['total_act_ret'] = shelly_data["total_act_ret"]
-    print(f"New offsets: {config['offsets']}")
+            meter.log(f"Shelly WebSocket failed: {e!r}")
+            metrics.poll_failures.inc(meter.name)
 
+        meter.log(f"Falling back to HTTP polling for {WEBSOCKET_RETRY_DELAY}s")
+        try:
+            await asyncio.wait_for(scheduler.poll(meter), WEBSOCKET_RETRY_DELAY)
+        except asyncio.TimeoutError:
+            pass
 
-if __name__ == '__main__':
-    signal.signal(signal.SIGTERM, handle_signal)
-    signal.signal(signal.SIGINT, handle_signal)
 
-    datablock, context = initialize_datablock_and_context(lock=lock)
-    set_offsets_on_startup()
+async def update_data_from_replay(meter):
+    """Serve the snapshots of a recording instead of the live Shelly."""
+    settings = meter.settings['replay']
+    speed = settings.get('speed', 1)
+    meter.log(f"Replaying {settings['file']} at {speed or 'maximum'}x speed")
+    try:
+        async for timestamp, values in replay(settings['file'], speed, settings.get('loop', False)):
+            meter.publish(values + (0.0,))
+    except Exception as e:
+        meter.log(f"Replay failed: {e!r}")
+        return
+    meter.log("Replay finished")
 
-    shelly_thread = threading.Thread(target=update_data_periodically, args=(context,), daemon=True)
-    shelly_thread.start()
-    start_modbus_server(context)
-    while not shutdown_event.is_set():
-        print(f"{datetime.datetime.now()}: Modbus Server stopped without shutdown event. Trying to restart")
-        start_modbus_server(context)
-        time.sleep(1)
 
-    print(f"{datetime.datetime.now()}: Modbus server stopped")
-    if shelly_thread and shelly_thread.is_alive():
-        shelly_thread.join()
-        print(f"{datetime.datetime.now()}: Shelly Thread stopped, exiting")
+def reload_config(current, meters, scheduler, path=CONFIG_FILE):
+    """Apply a changed config file between two polls and return the config now in effect.
 
+    The new file is validated and every meter's pipeline built before anything is swapped,
+    so an invalid file or a changed set of meters leaves the running config untouched.
+    Settings outside RELOADABLE_KEYS and RELOADABLE_CONFIG are logged and need a restart.
+    """
+    print(f"{datetime.datetime.now()}: Reloading {path}")
+    try:
+        with open(path) as f:
+            new = json.load(f)
+        settings = meter_settings(new)
+        if [meter['name'] for meter in settings] != [meter.name for meter in meters]:
+            raise ValueError("the meters changed, restart to apply")
+        interval = poll_interval(new)
+        previous = meter_settings(current)
+        prepared = [meter.prepare(meter_new, meter_new['offsets'] != meter_old['offsets'])
+                    for meter, meter_new, meter_old in zip(meters, settings, previous)]
+    except Exception as e:
+        print(f"{datetime.datetime.now()}: Ignoring {path}: {e!r}")
+        return current
+
+    # No await from here on, so no poll sees a half applied config
+    for meter, meter_new, built in zip(meters, settings, prepared):
+        meter.reconfigure(meter_new, *built)
+    if scheduler.interval != interval:
+        print(f"{datetime.datetime.now()}: Polling every {interval}s")
+        scheduler.interval = interval
+
+    restart = sorted(key for key in {**current, **new}
+                     if key not in DEFAULT_METER and key not in RELOADABLE_CONFIG and key != 'meters'
+                     and current.get(key) != new.get(key))
+    restart += [f"{meter_new['name']}.{key}" for meter_new, meter_old in zip(settings, previous)
+                for key in meter_new if key not in RELOADABLE_KEYS and meter_new[key] != meter_old[key]]
+    if restart:
+        print(f"{datetime.datetime.now()}: Changes to {', '.join(restart)} take effect after a restart")
+    return new
+
+
+def config_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
 
+async def watch_config(meters, scheduler, reload_event, path=CONFIG_FILE):
+    """Reload the config on SIGHUP (reload_event) or when the file changed."""
+    current = config
+    version = config_version(path)
+    while True:
+        try:
+            await asyncio.wait_for(reload_event.wait(), CONFIG_CHECK_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        changed = config_version(path)
+        if changed == version and not reload_event.is_set():
+            continue
+        reload_event.clear()
+        version = changed
+        if changed is not None:
+            current = reload_config(current, meters, scheduler, path)
+
+
+def rebaseline(meters):
+    """Handle SIGUSR1: take the next live sample's energy counters as offsets."""
+    for meter in meters:
+        meter.rebaseline()
+
+
+def report_failure(task, shutdown_event, essential):
+    """Done callback of a task: log its exception, and shut down if the gateway cannot go on without it."""
+    if task.cancelled() or task.exception() is None:
+        return
+    print(f"{datetime.datetime.now()}: ⚠️  {task.get_name()} failed: {task.exception()!r}")
+    if essential:
+        shutdown_event.set()
+
+
+def handle_signal(sig, shutdown_event):
+    """Handle SIGTERM and SIGINT (Ctrl+C)."""
+    print(f"{datetime.datetime.now()}: Received signal {sig}, shutting down...")
+    shutdown_event.set()
 
 
+async def main():
+    shutdown_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, handle_signal, sig, shutdown_event)
+
+    settings = meter_settings(config)
+    interval = poll_interval(config)
+    unit_ids = None if 'meters' not in config else [meter['unit_id'] for meter in settings]
+    datablocks, context = initialize_datablock_and_context(unit_ids)
+    meters = [Meter(meter, datablocks[meter['unit_id'] or 0]) for meter in settings]
+    reload_event = asyncio.Event()
+    loop.add_signal_handler(signal.SIGHUP, reload_event.set)
+    loop.add_signal_handler(signal.SIGUSR1, rebaseline, meters)
+    port = config.get('modbus_port', MODBUS_PORT)
+    response_cache = config.get('response_cache', True)
+    pool = None
+    if config.get('server_workers'):
+        pool = WorkerPool(datablocks, unit_ids is None, config['server_workers'], port,
+                          (IMAGE_START, IMAGE_START + IMAGE_LENGTH), response_cache)
+    publisher = MqttPublisher(config['mqtt']) if config.get('mqtt') else None
+    if publisher:
+        for meter in meters:
+            meter.mqtt = publisher.add(meter)
+    metrics.served_sample_age.set_function(
+        lambda: {(meter.name,): time.monotonic() - meter.datablock.published_at for meter in meters})
+    metrics.stale.set_function(lambda: {(meter.name,): int(meter.stale) for meter in meters})
+
+    # Serve the persisted snapshots right away, the first live samples replace them in the background
+    state_file = config.get('state_file', STATE_FILE)
+    persister = StatePersister(state_file, meters) if state_file else None
+    if persister:
+        for meter in meters:
+            if meter.name in persister.state:
+                meter.restore(persister.state[meter.name])
+
+    async with contextlib.AsyncExitStack() as stack:
+        for meter in meters:
+            await stack.enter_async_context(meter.shelly)
+
+        server = None
+        if pool:
+            stack.callback(pool.stop)
+            await pool.start()
+        else:
+            server = await start_modbus_server(context, port, response_cache)
+        if config.get('metrics_port'):
+            stack.push_async_callback((await metrics.start_metrics_server(config['metrics_port'])).cleanup)
+        scheduler = PollScheduler(interval)
+        tasks = [asyncio.create_task(watch_config(meters, scheduler, reload_event), name="Config watcher")]
+        if persister:
+            tasks.append(asyncio.create_task(persister.run(), name="State persister"))
+        if publisher:
+            tasks.append(asyncio.create_task(publisher.run(), name="MQTT publisher"))
+        # The gateway stops if one of these fails, rather than serving a stale image
+        essential = []
+        if pool:
+            trackers = {meter.unit_id or 0: meter.read_tracker for meter in meters}
+            tasks.append(asyncio.create_task(pool.collect_reads(trackers), name="Read collector"))
+            essential.append(asyncio.create_task(pool.monitor(), name="Worker monitor"))
+        for meter in meters:
+            if meter.recorder:
+                stack.callback(meter.recorder.close)
+                tasks.append(asyncio.create_task(meter.recorder.run(), name=f"Recorder of {meter.name}"))
+            if meter.settings['replay']:
+                tasks.append(asyncio.create_task(update_data_from_replay(meter), name=f"Replay of {meter.name}"))
+            elif meter.settings['ingestion'] == 'websocket':
+                tasks.append(asyncio.create_task(update_data_from_websocket(meter, scheduler),
+                                                 name=f"WebSocket of {meter.name}"))
+            else:
+                scheduler.add(meter)
+        if scheduler.meters:
+            essential.append(asyncio.create_task(scheduler.run(), name="Poll scheduler"))
+        for task in tasks:
+            task.add_done_callback(functools.partial(report_failure, shutdown_event=shutdown_event, essential=False))
+        for task in essential:
+            task.add_done_callback(functools.partial(report_failure, shutdown_event=shutdown_event, essential=True))
+        tasks += essential
+        await shutdown_event.wait()
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        print(f"{datetime.datetime.now()}: Shelly poller stopped")
+        if server:
+            await server.shutdown()
+        print(f"{datetime.datetime.now()}: Modbus server stopped")
+    for task in essential:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
 
 
+if __name__ == '__main__':
+    asyncio.run(main())
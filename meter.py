@@ -0,0 +1,186 @@
+import datetime
+import time
+
+import metrics
+from encoder import RegisterEncoder
+from pipeline import TransformPipeline, derive
+from register_mapping import modbus_name_to_register_map
+from shelly import ShellyClient
+from recording import Recorder
+from scheduler import InverterReadTracker
+from smoothing import WindowSmoother
+
+OFFSET_KEYS = [
+    "a_total_act_energy",
+    "a_total_act_ret_energy",
+    "b_total_act_energy",
+    "b_total_act_ret_energy",
+    "c_total_act_energy",
+    "c_total_act_ret_energy",
+    "total_act",
+    "total_act_ret",
+]
+EVT_ADDRESS = modbus_name_to_register_map["Evt"]
+RELOADABLE_KEYS = ("offsets", "nullify_channel", "smoothing")  # Meter settings a config reload applies live
+STALE_EVENT = 1 << 16  # First OEM bit of Evt, set while serving a persisted snapshot
+
+
+class Meter:
+    """One Shelly served as one Fronius meter under its own Modbus unit ID.
+
+    Unless offsets were restored from the state file, the first live sample sets them,
+    so the served energy counters start at zero. A meter replaying a recording serves
+    the recorded post-transform samples as they are.
+    """
+
+    def __init__(self, settings, datablock):
+        self.settings = settings
+        self.unit_id = settings['unit_id']
+        self.name = settings['name']
+        self.datablock = datablock
+        self.shelly = ShellyClient(settings['shelly_url'], fetch=settings['fetch'])
+        self.encoder = RegisterEncoder()
+        self.compile_pipeline()
+        smoothing = settings['smoothing']
+        self.smoother = WindowSmoother(smoothing['method'], smoothing['window'], self.pipeline.instantaneous) if smoothing else None
+        self.recorder = Recorder(settings['record_file']) if settings['record_file'] else None
+        self.mqtt = None  # DeltaFilter of the MqttPublisher, attached by main()
+        self.baseline_pending = not settings['replay']
+        self.offsets_version = 0
+        self.stale = False
+        self.registers = None
+        self.updated_at = None
+        self.read_tracker = InverterReadTracker(self.encoder.start, self.encoder.start + self.encoder.length, self.name)
+        datablock.read_tracker = self.read_tracker
+
+    def log(self, message):
+        print(f"{datetime.datetime.now()}: [{self.name}] {message}")
+
+    def compile_pipeline(self):
+        """(Re)build the transform pipeline, needed whenever offsets or nullify_channel change"""
+        self.pipeline = TransformPipeline(self.settings['offsets'], self.settings['nullify_channel'], self.encoder)
+
+    def prepare(self, settings, offsets_changed):
+        """Build the pipeline and smoother for reloaded settings, raising if they are invalid.
+
+        Nothing served changes until reconfigure() swaps them in. Unless the configured
+        offsets changed, the offsets in use (e.g. from a baseline) are kept.
+        """
+        offsets = dict(settings['offsets'] if offsets_changed else self.settings['offsets'])
+        pipeline = TransformPipeline(offsets, settings['nullify_channel'], self.encoder)
+        smoother = self.smoother
+        if settings['smoothing'] != self.settings['smoothing']:
+            smoothing = settings['smoothing']
+            smoother = WindowSmoother(smoothing['method'], smoothing['window'], pipeline.instantaneous) if smoothing else None
+        return offsets, pipeline, smoother
+
+    def reconfigure(self, settings, offsets, pipeline, smoother):
+        """Swap in what prepare() built; the next sample is served with it."""
+        changed = [key for key in ("nullify_channel", "smoothing") if settings[key] != self.settings[key]]
+        if offsets != self.settings['offsets']:
+            changed.insert(0, "offsets")
+            self.offsets_version += 1
+            self.baseline_pending = False  # Configured offsets replace a pending baseline
+        self.settings.update(offsets=offsets, nullify_channel=settings['nullify_channel'], smoothing=settings['smoothing'])
+        self.pipeline = pipeline
+        self.smoother = smoother
+        if changed:
+            self.log(f"Reloaded {', '.join(changed)}")
+
+    def rebaseline(self):
+        """Take the energy counters of the next live sample as new offsets."""
+        if self.settings['replay']:
+            return
+        self.baseline_pending = True
+        self.log("Re-baselining offsets with the next sample")
+
+    def restore(self, saved):
+        """Serve a persisted register image, flagged stale, and keep counting from its offsets."""
+        registers = list(saved['registers'])
+        if len(registers) != self.encoder.length or set(saved['offsets']) != set(OFFSET_KEYS):
+            self.log("Ignoring persisted state that does not match this version")
+            return
+        self.settings['offsets'].update(saved['offsets'])
+        self.compile_pipeline()
+        self.baseline_pending = False
+
+        evt = EVT_ADDRESS - self.encoder.start
+        registers[evt:evt + 2] = [STALE_EVENT >> 16, STALE_EVENT & 0xFFFF]
+        age = max(0, time.time() - saved['time'])
+        self.datablock.setValues(self.encoder.start, registers, time.monotonic() - age)
+        self.stale = True
+        self.log(f"Serving persisted snapshot from {datetime.datetime.fromtimestamp(saved['time'])} until the first live sample")
+
+    def state(self):
+        """Return the last live register image and the offsets, or None before the first live sample."""
+        if self.registers is None or self.settings['replay']:
+            return None
+        return {"offsets": dict(self.settings['offsets']), "registers": self.registers, "time": self.updated_at}
+
+    async def read_shelly(self):
+        started = time.perf_counter()
+        bodies = await self.shelly.fetch_em()
+        fetched = time.perf_counter()
+        shelly_data = self.shelly.parse_em(bodies)
+        decoded = time.perf_counter()
+        metrics.stage_seconds.observe(fetched - started, self.name, "fetch")
+        metrics.stage_seconds.observe(decoded - fetched, self.name, "decode")
+        return shelly_data
+
+    def update_registers(self, shelly_data):
+        if self.baseline_pending:
+            self.set_offsets(shelly_data)
+        started = time.perf_counter()
+        measured = self.pipeline.measure(shelly_data)
+        outputs = derive(measured)
+        metrics.stage_seconds.observe(time.perf_counter() - started, self.name, "transform")
+        now = time.time()
+        if self.recorder:
+            self.recorder.append(now, outputs)
+        self.publish(outputs)
+        # Only once the registers are served, so MQTT can never hold up or break the inverter's data
+        if self.mqtt:
+            try:
+                self.mqtt.add(now, outputs)
+            except Exception as e:
+                self.log(f"Dropped sample for MQTT: {e!r}")
+
+    def publish(self, outputs):
+        """Serve one post-transform snapshot, the values of pipeline.OUTPUT_NAMES in order."""
+        transformed = time.perf_counter()
+        values = self.pipeline.gather(outputs)
+        if self.smoother:
+            values = self.smoother.add(values)
+        smoothed = time.perf_counter()
+        registers = self.encoder.encode_values(values).tolist()
+        encoded = time.perf_counter()
+        changed = self.datablock.update(self.encoder.start, registers)
+        written = time.perf_counter()
+        if self.smoother:
+            metrics.stage_seconds.observe(smoothed - transformed, self.name, "smooth")
+        metrics.stage_seconds.observe(encoded - smoothed, self.name, "encode")
+        metrics.stage_seconds.observe(written - encoded, self.name, "set_values")
+        metrics.registers.inc(self.name, "written", amount=changed)
+        metrics.registers.inc(self.name, "skipped", amount=len(registers) - changed)
+        if not changed:
+            metrics.unchanged_updates.inc(self.name)
+        self.registers = registers
+        self.updated_at = time.time()
+        if self.stale:
+            self.stale = False
+            self.log("Serving live data")
+
+    async def update_context(self):
+        shelly_data = await self.read_shelly()
+        self.update_registers(shelly_data)
+
+    def set_offsets(self, shelly_data):
+        """Use the current energy counters as offsets, so the served counters start at zero."""
+        offsets = self.settings['offsets']
+        self.log(f"Old offsets: {offsets}")
+        for key in OFFSET_KEYS:
+            offsets[key] = shelly_data[key]
+        self.compile_pipeline()
+        self.baseline_pending = False
+        self.offsets_version += 1
+        self.log(f"New offsets: {offsets}")
@@ -0,0 +1,162 @@
+"""Prometheus metrics of the gateway.
+
+Collection is a few list and dict operations per observation, so the instruments
+are always updated; the HTTP endpoint serving them is optional.
+"""
+import bisect
+import datetime
+
+from aiohttp import web
+
+STAGE_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+AGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames, labels, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose values are read from a callback returning {labels: value} at scrape time."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.collect = dict
+        registry.append(self)
+
+    def set_function(self, collect):
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self.series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        registry.append(self)
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "shelly_gateway_stage_seconds",
+    "Duration of each stage of a register update.",
+    STAGE_BUCKETS, ("meter", "stage"))
+modbus_requests = Counter(
+    "shelly_gateway_modbus_requests_total",
+    "Modbus requests received, by function code and unit ID.",
+    ("function_code", "unit"))
+poll_failures = Counter(
+    "shelly_gateway_poll_failures_total",
+    "Failed Shelly fetches or register updates.",
+    ("meter",))
+read_data_age = Histogram(
+    "shelly_gateway_read_data_age_seconds",
+    "Age of the served sample when the inverter read it.",
+    AGE_BUCKETS, ("meter",))
+served_sample_age = Gauge(
+    "shelly_gateway_served_sample_age_seconds",
+    "Seconds since the currently served sample was published.",
+    ("meter",))
+stale = Gauge(
+    "shelly_gateway_stale",
+    "1 while the meter serves the persisted snapshot from before the last restart.",
+    ("meter",))
+registers = Counter(
+    "shelly_gateway_registers_total",
+    "Registers of the updates, written because they changed or skipped as unchanged.",
+    ("meter", "result"))
+unchanged_updates = Counter(
+    "shelly_gateway_unchanged_updates_total",
+    "Updates that changed no register and wrote nothing.",
+    ("meter",))
+mqtt_messages = Counter(
+    "shelly_gateway_mqtt_messages_total",
+    "MQTT messages published, delta or full snapshots.",
+    ("kind",))
+mqtt_bytes = Counter(
+    "shelly_gateway_mqtt_bytes_total",
+    "Bytes of the published MQTT packets.",
+    ("kind",))
+
+
+def trace_pdu(sending, pdu):
+    """pymodbus trace_pdu hook counting received requests."""
+    if not sending:
+        modbus_requests.inc(pdu.function_code, pdu.dev_id)
+    return pdu
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request):
+    return web.Response(body=render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_metrics_server(port, host="0.0.0.0"):
+    print(f"{datetime.datetime.now()}: Serving metrics on http://{host}:{port}/metrics")
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,27 +1,215 @@
-from pymodbus.server import StartTcpServer
-from pymodbus.datastore import ModbusSparseDataBlock
+import struct
+import time
+
 from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+from pymodbus.datastore.store import BaseModbusDataBlock
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu.register_message import ReadHoldingRegistersRequest, ReadHoldingRegistersResponse
+
+MAX_ENCODED_RANGES = 256  # Bound on cached response payloads per datablock
+SPAN_CHUNK = 8  # Registers compared as one, four float32 values of the image
+DENSE_REPEAT = 16  # Changed images written whole without a diff after one in which most registers changed
+
+
+def changed_spans(current, values, chunk=SPAN_CHUNK):
+    """Return [(offset, values)] covering the registers in which values differ from current.
+
+    Compares chunk registers at a time, a changed chunk is written whole and adjacent
+    changed chunks form one span. Once most chunks changed, the one span is all of values.
+    """
+    if current == values:
+        return []
+    spans = []
+    start = None
+    most = len(values) // (2 * chunk)
+    for i in range(0, len(values), chunk):
+        if current[i:i + chunk] != values[i:i + chunk]:
+            most -= 1
+            if most < 0:
+                return [(0, values)]
+            if start is None:
+                start = i
+        elif start is not None:
+            spans.append((start, values[start:i]))
+            start = None
+    if start is not None:
+        spans.append((start, values[start:]))
+    return spans
+
+
+class SnapshotDataBlock(BaseModbusDataBlock):
+    """Dense, double-buffered data block.
+
+    Writes go to the back buffer, which is then published by swapping it to the front,
+    so reads never block and always return registers from one single published image.
+    The version counter works like a seqlock: it is odd while the back buffer is being
+    written. A reader only retries in the rare case that the buffer it sliced was
+    recycled for a newer write in the meantime.
+
+    If a read_tracker is attached, reads overlapping its [start, end) window are
+    reported to it together with the time the served image was published.
 
-class LockedSparseDataBlock(ModbusSparseDataBlock):
-    """Thread-safe sparse data block for Modbus."""
+    getEncoded() returns register ranges as read response payloads, cached per
+    (address, count) until the next write bumps the version.
 
-    def __init__(self, values, lock):
-        super().__init__(values)
-        self.lock = lock  # Shared lock for thread safety
+    update() writes only the spans of an image that changed, compared SPAN_CHUNK
+    registers at a time. Both buffers then differ only in the spans of the last write
+    (dirty), so bringing the back buffer up to date copies just those. An unchanged
+    image is not written at all and keeps the version, and with it the cached responses.
+    Live samples change most registers, so once a diff finds that, the next DENSE_REPEAT
+    changed images are written whole without diffing them.
+
+    If a shared image is attached (see shared.WorkerPool), every write is also
+    published there for the server worker processes.
+    """
+
+    def __init__(self, address, values):
+        self.address = address
+        self.default_value = 0
+        self.initial = list(values)
+        self.front = list(values)
+        self.back = list(values)
+        self.version = 0
+        self.published_at = time.monotonic()
+        self.read_tracker = None
+        self.encoded = {}
+        self.shared = None
+        self.dirty = []  # (offset, count) in which back lags behind front
+        self.dense_writes = 0  # Changed images update() still writes whole without a diff
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        """Build a dense block from {address: [values]}, later blocks overwriting earlier ones."""
+        start = min(blocks)
+        end = max(address + len(values) for address, values in blocks.items())
+        dense = [0] * (end - start)
+        for address, values in blocks.items():
+            dense[address - start:address - start + len(values)] = values
+        return cls(start, dense)
+
+    @property
+    def values(self):
+        return self.front
+
+    def reset(self):
+        self.setValues(self.address, self.initial)
+
+    def validate(self, address, count=1):
+        return self.address <= address and address + count <= self.address + len(self.front)
 
     def getValues(self, address, count=1):
-        """Ensure thread-safe reads."""
-        with self.lock:
-            return super().getValues(address, count)
+        start = address - self.address
+        while True:
+            version = self.version
+            values = self.front[start:start + count]
+            # The buffer read above is only rewritten once the version passes the next odd value
+            if self.version <= (version | 1) + 1:
+                break
+        self.track_read(address, count)
+        return values
+
+    def track_read(self, address, count):
+        tracker = self.read_tracker
+        if tracker is not None and address < tracker.end and address + count > tracker.start:
+            tracker.record(self.published_at)
+
+    def getEncoded(self, address, count=1):
+        """Return the byte count and the big-endian registers of a read response."""
+        key = (address, count)
+        version = self.version
+        cached = self.encoded.get(key)
+        if cached is not None and cached[0] == version:
+            self.track_read(address, count)
+            return cached[1]
+        values = self.getValues(address, count)
+        payload = struct.pack(f">B{count}H", 2 * count, *values)
+        # Only cache what was read from a published image that is still current
+        if not version & 1 and self.version == version:
+            if len(self.encoded) >= MAX_ENCODED_RANGES:
+                self.encoded.clear()
+            self.encoded[key] = (version, payload)
+        return payload
 
-    def setValues(self, address, values):
-        """Ensure thread-safe writes."""
-        with self.lock:
-            return super().setValues(address, values)
+    def setValues(self, address, values, published_at=None):
+        if not isinstance(values, list):
+            values = [values]
+        self.write_spans([(address - self.address, values)], published_at)
 
-def initialize_datablock_and_context(lock):
+    def update(self, address, values, published_at=None):
+        """Write the registers of values that differ from the served ones, return how many were written."""
+        start = address - self.address
+        current = self.front[start:start + len(values)]
+        if self.dense_writes and current != values:
+            # Live samples change most registers, diffing them again would cost more than it saves
+            self.dense_writes -= 1
+            self.write_spans([(start, values)], published_at)
+            return len(values)
+        spans = changed_spans(current, values)
+        if not spans:
+            self.published_at = time.monotonic() if published_at is None else published_at
+            if self.shared is not None:
+                self.shared.touch(self.published_at)
+            return 0
+        if len(spans) == 1 and len(spans[0][1]) == len(values):
+            self.dense_writes = DENSE_REPEAT
+        self.write_spans([(start + offset, span) for offset, span in spans], published_at)
+        return sum(len(span) for _, span in spans)
+
+    def write_spans(self, spans, published_at=None):
+        """Publish a new image differing from the current one in [(offset, values)]."""
+        front = self.front
+        back = self.back
+        self.version += 1
+        for offset, count in self.dirty:
+            back[offset:offset + count] = front[offset:offset + count]
+        for offset, values in spans:
+            back[offset:offset + len(values)] = values
+        self.back = front
+        self.front = back
+        self.dirty = [(offset, len(values)) for offset, values in spans]
+        self.version += 1
+        self.published_at = time.monotonic() if published_at is None else published_at
+        if self.shared is not None:
+            self.shared.publish_spans(spans, self.published_at)
+
+class EncodedRegistersResponse(ReadHoldingRegistersResponse):
+    """Read registers response sending a payload prepared by SnapshotDataBlock.getEncoded()."""
+
+    def __init__(self, function_code, payload, dev_id=1, transaction_id=0):
+        super().__init__(dev_id=dev_id, transaction_id=transaction_id)
+        self.function_code = function_code
+        self.payload = payload
+
+    def encode(self):
+        return self.payload
+
+
+class CachedReadHoldingRegistersRequest(ReadHoldingRegistersRequest):
+    """Read holding registers answered from the datablock's encoded response cache."""
+
+    async def update_datastore(self, context):
+        if not context.validate(self.function_code, self.address, self.count):
+            return ExceptionResponse(self.function_code, ExceptionResponse.ILLEGAL_ADDRESS)
+        datablock = context.store[context.decode(self.function_code)]
+        payload = datablock.getEncoded(self.address + 1, self.count)
+        return EncodedRegistersResponse(self.function_code, payload, self.dev_id, self.transaction_id)
+
+
+class CachedReadInputRegistersRequest(CachedReadHoldingRegistersRequest):
+    """Read input registers answered from the datablock's encoded response cache."""
+
+    function_code = 4
+
+
+CACHED_REQUESTS = [CachedReadHoldingRegistersRequest, CachedReadInputRegistersRequest]
+
+def string_to_registers(value, length):
+    """Encode an ASCII string as one character per register, zero padded."""
+    return [ord(c) for c in value] + [0] * (length - len(value))
+
+def create_datablock(device_address=240, serial_number="00000002"):
     # Initialize the data block with initial values
-    datablock = LockedSparseDataBlock({
+    return SnapshotDataBlock.from_blocks({
         1: [21365, 28243],
         3: [1],
         4: [65],
@@ -29,20 +217,36 @@ def initialize_datablock_and_context(lock):
             83, 109, 97, 114, 116, 32, 77, 101, 116, 101, 114, 32, 54, 51, 65, 0,  # Device Model "Smart Meter"
             0, 0, 0, 0, 0, 0, 0, 0,  # Options N/A
             0, 0, 0, 0, 0, 0, 0, 0,  # Software Version N/A
-            48, 48, 48, 48, 48, 48, 48, 50, 0, 0, 0, 0, 0, 0, 0, 0,  # Serial Number: 00000
-            240],  # Modbus TCP Address: 240
+            *string_to_registers(serial_number, 16),  # Serial Number
+            device_address],  # Modbus TCP Address
         70: [213],
         71: [124],
         72: [0] * 128,  # Initialize address 72 with 128 zeros for payload
         196: [65535, 0],
-    }, lock)
+    })
 
+def create_slave_context(datablock):
     # Create a Modbus slave context
-    slave_context = ModbusSlaveContext(
+    return ModbusSlaveContext(
         di=datablock,  # Discrete Inputs
         co=datablock,  # Coils
         hr=datablock,  # Holding Registers
         ir=datablock,  # Input Registers
     )
-    context = ModbusServerContext(slaves = slave_context, single = True)
-    return datablock, context
\ No newline at end of file
+
+def initialize_datablock_and_context(unit_ids=None):
+    """Create the datablocks and the server context.
+
+    Without unit_ids a single datablock answers on every unit ID. Otherwise every unit ID
+    gets its own datablock, with the unit ID as device address and serial number.
+    Returns ({unit_id: datablock}, context).
+    """
+    if unit_ids is None:
+        datablock = create_datablock()
+        context = ModbusServerContext(slaves = create_slave_context(datablock), single = True)
+        return {0: datablock}, context
+
+    datablocks = {unit_id: create_datablock(unit_id, f"{unit_id:08d}") for unit_id in unit_ids}
+    slaves = {unit_id: create_slave_context(datablock) for unit_id, datablock in datablocks.items()}
+    context = ModbusServerContext(slaves = slaves, single = False)
+    return datablocks, context
@@ -0,0 +1,175 @@
+"""Publishing the meter samples to an MQTT broker.
+
+Needs the optional aiomqtt package (pip install -r requirements-mqtt.txt), which only
+has to be installed when "mqtt" is configured. Messages go out at QoS 0.
+
+Every meter publishes at most one compact JSON object per interval, e.g.
+    {"t":1739871234.52,"W":-1234.5,"AphA":-5.12}
+holding only the quantities (pipeline.OUTPUT_NAMES) that moved by more than their
+deadband since they were last published. Samples in between are merged, so the
+message carries the latest values. Every full_interval and after each (re)connect,
+all quantities are sent as a retained message, which new subscribers get right away.
+"""
+import asyncio
+import datetime
+import math
+import time
+
+try:
+    import aiomqtt
+except ImportError:
+    aiomqtt = None
+
+import metrics
+from pipeline import OUTPUT_NAMES
+
+MQTT_PORT = 1883
+MQTT_TOPIC = "shelly-fronius-gateway"
+PUBLISH_INTERVAL = 1
+FULL_INTERVAL = 60
+RETRY_DELAY = 10
+KEEPALIVE = 60
+DEFAULT_DEADBANDS = {"A": 0.05, "V": 0.5, "W": 5, "VA": 5, "VAR": 5, "Hz": 0.01, "PF": 0.01, "Wh": 1}
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def unit(name):
+    """Return the DEFAULT_DEADBANDS key of a quantity of pipeline.OUTPUT_NAMES."""
+    if name.startswith("TotWh"):
+        return "Wh"
+    for prefix, key in (("PhV", "V"), ("PPV", "V"), ("VAR", "VAR"), ("VA", "VA"), ("W", "W"), ("Hz", "Hz"),
+                        ("PF", "PF"), ("A", "A")):
+        if name.startswith(prefix):
+            return key
+    raise ValueError(f"No unit for {name}")
+
+
+def deadbands(overrides, names=OUTPUT_NAMES):
+    """Return one deadband per name; overrides are keyed by unit ("W") or by quantity ("WphA")."""
+    if not isinstance(overrides, dict):
+        raise ValueError("mqtt deadband must be an object like {\"W\": 5}.")
+    unknown = [key for key in overrides if key not in DEFAULT_DEADBANDS and key not in names]
+    if unknown:
+        raise ValueError(f"Unknown deadband keys {unknown}, use units {list(DEFAULT_DEADBANDS)} or register names.")
+    invalid = {key: value for key, value in overrides.items() if not is_number(value) or value < 0}
+    if invalid:
+        raise ValueError(f"Deadbands must be non-negative numbers: {invalid}")
+    bands = {**DEFAULT_DEADBANDS, **overrides}
+    return [overrides.get(name, bands[unit(name)]) for name in names]
+
+
+def seconds(settings, key, default):
+    """Return settings[key] (or default), raising ValueError unless it is a positive number."""
+    value = settings.get(key, default)
+    if not is_number(value) or value <= 0:
+        raise ValueError(f"mqtt {key} must be a positive number of seconds.")
+    return value
+
+
+def packet_size(topic, payload):
+    """Return the bytes of the QoS 0 PUBLISH packet carrying payload."""
+    length = 2 + len(topic.encode()) + len(payload)
+    return 1 + 1 + (length >= 1 << 7) + (length >= 1 << 14) + (length >= 1 << 21) + length
+
+
+class DeltaFilter:
+    """Collects the samples of one meter and returns the changes to publish.
+
+    A quantity is pending once it differs from its last published value by more than
+    its deadband; pending quantities follow the latest sample until they are published.
+    """
+
+    def __init__(self, topic, bands, names=OUTPUT_NAMES):
+        self.topic = topic
+        self.names = names
+        self.bands = bands
+        self.latest = None
+        self.published = [None] * len(names)
+        self.pending = {}
+        self.timestamp = None
+
+    def add(self, timestamp, values):
+        """Add one sample; values may hold more entries than names, the rest is ignored."""
+        self.timestamp = timestamp
+        self.latest = values
+        pending = self.pending
+        published = self.published
+        for i, band in enumerate(self.bands):
+            value = values[i]
+            if i in pending or published[i] is None or abs(value - published[i]) > band:
+                pending[i] = value
+
+    def payload(self, full=False):
+        """Return the JSON payload of the pending (or, if full, all) quantities and mark them published."""
+        if self.latest is None or not (full or self.pending):
+            return None
+        if full:
+            self.pending = dict(enumerate(self.latest[:len(self.names)]))
+        names = self.names
+        fields = [f'"t":{self.timestamp:.2f}']
+        for i, value in self.pending.items():
+            fields.append(f'"{names[i]}":{value:.7g}')  # float32 precision, like the registers
+            self.published[i] = value
+        self.pending = {}
+        return ("{" + ",".join(fields) + "}").encode()
+
+
+class MqttPublisher:
+    """Publishes the samples of the meters to an MQTT broker, reconnecting when it goes away.
+
+    settings is the "mqtt" object of config.json, checked here so that a bad one stops
+    the gateway at startup. A single meter publishes to topic, several to topic/<unit_id>.
+    """
+
+    def __init__(self, settings):
+        if aiomqtt is None:
+            raise ValueError("mqtt needs the aiomqtt package, install it with: pip install -r requirements-mqtt.txt")
+        if not settings.get('host'):
+            raise ValueError("mqtt needs a 'host'.")
+        self.host = settings['host']
+        self.port = settings.get('port', MQTT_PORT)
+        self.client_id = settings.get('client_id', MQTT_TOPIC)
+        self.username = settings.get('username')
+        self.password = settings.get('password')
+        self.topic = settings.get('topic', MQTT_TOPIC)
+        self.interval = seconds(settings, 'interval', PUBLISH_INTERVAL)
+        self.full_interval = seconds(settings, 'full_interval', FULL_INTERVAL)
+        self.bands = deadbands(settings.get('deadband', {}))
+        self.filters = []
+
+    def add(self, meter):
+        """Return the DeltaFilter the meter adds its samples to."""
+        topic = self.topic if meter.unit_id is None else f"{self.topic}/{meter.unit_id}"
+        delta = DeltaFilter(topic, self.bands)
+        self.filters.append(delta)
+        return delta
+
+    async def publish(self, client, full):
+        kind = "full" if full else "delta"
+        for delta in self.filters:
+            payload = delta.payload(full)
+            if payload is not None:
+                await client.publish(delta.topic, payload, retain=full)
+                metrics.mqtt_messages.inc(kind)
+                metrics.mqtt_bytes.inc(kind, amount=packet_size(delta.topic, payload))
+
+    async def run(self):
+        while True:
+            try:
+                async with aiomqtt.Client(self.host, self.port, identifier=self.client_id, username=self.username,
+                                          password=self.password, keepalive=KEEPALIVE) as client:
+                    print(f"{datetime.datetime.now()}: Publishing to MQTT broker {self.host}:{self.port}")
+                    deadline = next_full = time.monotonic()
+                    while True:
+                        full = time.monotonic() >= next_full
+                        if full:
+                            next_full += self.full_interval
+                        await self.publish(client, full)
+                        deadline += self.interval
+                        await asyncio.sleep(max(0, deadline - time.monotonic()))
+            except Exception as e:
+                print(f"{datetime.datetime.now()}: MQTT publishing failed: {e!r}, retrying in {RETRY_DELAY}s")
+                await asyncio.sleep(RETRY_DELAY)
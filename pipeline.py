@@ -0,0 +1,153 @@
+import math
+from operator import itemgetter
+
+from register_mapping import modbus_name_to_register_map
+
+SQRT3 = math.sqrt(3)
+CHANNELS = ['a', 'b', 'c']
+
+# Register values produced by TransformPipeline.run, in this order
+OUTPUT_NAMES = (
+    "AphA", "AphB", "AphC", "A",
+    "PhVphA", "PhVphB", "PhVphC",
+    "PPVphAB", "PPVphBC", "PPVphCA", "PPV",
+    "Hz",
+    "WphA", "WphB", "WphC", "W",
+    "VAphA", "VAphB", "VAphC", "VA",
+    "VARphA", "VARphB", "VARphC", "VAR",
+    "PFphA", "PFphB", "PFphC", "PF",
+    "TotWhExpPhA", "TotWhExpPhB", "TotWhExpPhC", "TotWhExp",
+    "TotWhImpPhA", "TotWhImpPhB", "TotWhImpPhC", "TotWhImp",
+)
+
+# The values measured by the Shelly, after offsets and nullify_channel, from which derive()
+# computes all of OUTPUT_NAMES.
+MEASURED_NAMES = (
+    "AphA", "AphB", "AphC",
+    "PhVphA", "PhVphB", "PhVphC",
+    "Hz",
+    "WphA", "WphB", "WphC", "W",
+    "VAphA", "VAphB", "VAphC", "VA",
+    "PFphA", "PFphB", "PFphC",
+    "TotWhExpPhA", "TotWhExpPhB", "TotWhExpPhC", "TotWhExp",
+    "TotWhImpPhA", "TotWhImpPhB", "TotWhImpPhC", "TotWhImp",
+)
+
+
+def read_phase(data, keys, nullified, offset_imp, offset_exp):
+    """Return (current, voltage, act_power, aprt_power, pf, freq, imp_energy, exp_energy) of one channel."""
+    current_key, voltage_key, act_key, aprt_key, pf_key, freq_key, imp_key, exp_key = keys
+    if nullified:
+        return 0, data[voltage_key], 0, 0, 0, data[freq_key], 0, 0
+    current = data[current_key]
+    act = data[act_key]
+    pf = data[pf_key]
+    if act < 0:
+        current = -current
+        if pf > 0:
+            pf = -pf
+    return (current, data[voltage_key], act, data[aprt_key], pf, data[freq_key],
+            data[imp_key] - offset_imp, data[exp_key] - offset_exp)
+
+
+def reactive_power(aprt, act):
+    rad = aprt ** 2 - act ** 2
+    return math.sqrt(rad) if rad > 0 else 0
+
+
+class TransformPipeline:
+    """remove_offsets, nullify_channel and map_values_to_registers compiled for one meter.
+
+    Offsets and nullified channels are resolved once at construction. run() takes the
+    merged 'em:0'/'emdata:0' dict, computes every register value in one pass and
+    returns them already ordered like the slots of the given RegisterEncoder, ready
+    for encode_values(). Raises ValueError at construction if a produced value has no
+    register in the map, instead of silently dropping it.
+    """
+
+    def __init__(self, offsets, nullify_channel, encoder):
+        for channel in nullify_channel:
+            if channel not in CHANNELS:
+                raise ValueError("Channel must be 'a', 'b', or 'c'.")
+        missing = [name for name in OUTPUT_NAMES if name not in modbus_name_to_register_map]
+        if missing:
+            raise ValueError(f"No register for {missing}")
+
+        self.phases = [
+            ((f"{ch}_current", f"{ch}_voltage", f"{ch}_act_power", f"{ch}_aprt_power", f"{ch}_pf", f"{ch}_freq",
+              f"{ch}_total_act_energy", f"{ch}_total_act_ret_energy"),
+             ch in nullify_channel, offsets[f"{ch}_total_act_energy"], offsets[f"{ch}_total_act_ret_energy"])
+            for ch in CHANNELS
+        ]
+        self.recompute_totals = bool(nullify_channel)
+        self.offset_imp = offsets["total_act"]
+        self.offset_exp = offsets["total_act_ret"]
+
+        # Gather the outputs into encoder slot order, unmapped slots take the trailing 0.0
+        output_index = {modbus_name_to_register_map[name]: i for i, name in enumerate(OUTPUT_NAMES)}
+        slots = sorted(encoder.slots, key=encoder.slots.get)
+        gathered = [output_index.get(address, len(OUTPUT_NAMES)) for address in slots]
+        self.gather = itemgetter(*gathered)
+        # Positions in run()'s result holding instantaneous values, i.e. everything but the energy counters
+        self.instantaneous = [position for position, i in enumerate(gathered)
+                              if i < len(OUTPUT_NAMES) and not OUTPUT_NAMES[i].startswith("TotWh")]
+
+    def run(self, data):
+        return self.gather(self.compute(data))
+
+    def compute(self, data):
+        """Return the values of OUTPUT_NAMES, followed by 0.0 for the unmapped slots; gather() orders them like the slots."""
+        return derive(self.measure(data))
+
+    def measure(self, data):
+        """Return the values of MEASURED_NAMES."""
+        (a_cur, a_v, a_act, a_aprt, a_pf, a_freq, a_imp, a_exp), \
+            (b_cur, b_v, b_act, b_aprt, b_pf, b_freq, b_imp, b_exp), \
+            (c_cur, c_v, c_act, c_aprt, c_pf, c_freq, c_imp, c_exp) = [read_phase(data, *phase) for phase in self.phases]
+
+        if self.recompute_totals:
+            act = a_act + b_act + c_act
+            aprt = a_aprt + b_aprt + c_aprt
+            imp = a_imp + b_imp + c_imp
+            exp = a_exp + b_exp + c_exp
+        else:
+            act = data['total_act_power']
+            aprt = data['total_aprt_power']
+            imp = data['total_act'] - self.offset_imp
+            exp = data['total_act_ret'] - self.offset_exp
+
+        return (
+            a_cur, b_cur, c_cur,
+            a_v, b_v, c_v,
+            c_freq,
+            a_act, b_act, c_act, act,
+            a_aprt, b_aprt, c_aprt, aprt,
+            a_pf, b_pf, c_pf,
+            a_exp, b_exp, c_exp, exp,
+            a_imp, b_imp, c_imp, imp,
+        )
+
+
+def derive(measured):
+    """Return the values of OUTPUT_NAMES and the trailing 0.0 from the values of MEASURED_NAMES."""
+    (a_cur, b_cur, c_cur, a_v, b_v, c_v, freq, a_act, b_act, c_act, act, a_aprt, b_aprt, c_aprt, aprt,
+     a_pf, b_pf, c_pf, a_exp, b_exp, c_exp, exp, a_imp, b_imp, c_imp, imp) = measured
+
+    ab = SQRT3 * a_v
+    bc = SQRT3 * b_v
+    ca = SQRT3 * c_v
+
+    return (
+        a_cur, b_cur, c_cur, a_cur + b_cur + c_cur,
+        a_v, b_v, c_v,
+        ab, bc, ca, (ab + bc + ca) / 3,
+        freq,
+        a_act, b_act, c_act, act,
+        a_aprt, b_aprt, c_aprt, aprt,
+        reactive_power(a_aprt, a_act), reactive_power(b_aprt, b_act), reactive_power(c_aprt, c_act),
+        reactive_power(aprt, act),
+        a_pf, b_pf, c_pf, (a_pf + b_pf + c_pf) / 3,
+        a_exp, b_exp, c_exp, exp,
+        a_imp, b_imp, c_imp, imp,
+        0.0,
+    )
@@ -1,14 +1,19 @@
 from pymodbus.client import ModbusTcpClient
-from pymodbus.client.mixin import ModbusClientMixin
 from register_mapping import registers
+import argparse
+import csv
+import json
 import struct
-import math
+import sys
+import threading
+import time
 
 # Replace with the actual IP address of your inverter
 HOST = "localhost"
 PORT = 502  # Default Modbus TCP port
 UNIT_ID_INVERTER = 1  # Modbus unit ID for the inverter
 UNIT_ID_METER = 200   # Modbus unit ID for the external energy meter
+MAX_READ_COUNT = 125  # Modbus limit for one read_holding_registers request
 
 def convert_float32(registers):
     """Convert two 16-bit registers into a 32-bit float."""
@@ -21,25 +26,27 @@ def convert_int16(value):
     """Convert UInt16 to Int16."""
     return value - 65536 if value > 32767 else value
 
-def read_modbus_register(client, address, length):
+def read_modbus_register(client, address, length, unit=UNIT_ID_INVERTER):
     """Read a Modbus register and return the raw data."""
-    response = client.read_holding_registers(address-1, count=length, slave=UNIT_ID_INVERTER)
+    response = client.read_holding_registers(address-1, count=length, slave=unit)
     if response.isError():
         raise Exception(f"Modbus read error: {response}")
     return response.registers
 
 
-def decode_register(registers, data_type):
+def decode_register(registers, data_type, bitfield_as_dict=True):
     """Decode Modbus register data based on the specified type."""
     if data_type == "uint16":
-        return client.convert_from_registers(registers, ModbusClientMixin.DATATYPE.UINT16)
+        return registers[0]
     elif data_type == "uint32":
-        return client.convert_from_registers(registers, ModbusClientMixin.DATATYPE.UINT32)
+        return (registers[0] << 16) | registers[1]
     elif data_type == "float32":
-        return client.convert_from_registers(registers, ModbusClientMixin.DATATYPE.FLOAT32)
+        return convert_float32(registers)
     elif data_type == "bitfield32":
         # Treat bitfield32 as a uint32 and return the raw value
-        raw_value = client.convert_from_registers(registers, ModbusClientMixin.DATATYPE.UINT32)
+        raw_value = (registers[0] << 16) | registers[1]
+        if not bitfield_as_dict:
+            return raw_value
         # Optionally, you can return a dictionary of bit positions and their values
         bitfield_dict = {i: bool((raw_value >> i) & 1) for i in range(32)}
         return bitfield_dict  # Return either raw_value or bitfield_dict based on your needs
@@ -55,26 +62,115 @@ def decode_register(registers, data_type):
     else:
         raise ValueError(f"Unsupported data type: {data_type}")
 
-def read_all_registers(client, registers):
-    data = {}
-    for reg in registers:
-        address = reg["address"] # Convert to 0-based index
-        length = reg["length"]
-        data_type = reg["type"]
-
-        registers_data = read_modbus_register(client, address, length)
+def plan_block_reads(registers, max_count=MAX_READ_COUNT):
+    """Group registers into the fewest contiguous reads of at most max_count registers.
 
-        value = decode_register(registers_data, data_type)
+    Returns a list of (address, count, [registers in this block]).
+    """
+    blocks = []
+    for reg in sorted(registers, key=lambda r: r["address"]):
+        end = reg["address"] + reg["length"]
+        if blocks:
+            address, count, members = blocks[-1]
+            if address + count == reg["address"] and end - address <= max_count:
+                blocks[-1] = (address, end - address, members + [reg])
+                continue
+        blocks.append((reg["address"], reg["length"], [reg]))
+    return blocks
 
-        data[reg["name"]] = {"value": value, "description": reg["description"]}
+def read_all_registers(client, registers, unit=UNIT_ID_INVERTER, plan=None):
+    """Read all registers with as few requests as possible and decode them locally."""
+    data = {}
+    for address, count, members in plan or plan_block_reads(registers):
+        block = read_modbus_register(client, address, count, unit)
+        for reg in members:
+            offset = reg["address"] - address
+            value = decode_register(block[offset:offset + reg["length"]], reg["type"])
+            data[reg["name"]] = {"value": value, "description": reg["description"]}
     return data
 
-if __name__ == "__main__":
-    client = ModbusTcpClient(HOST, port=PORT)
+def read_snapshot(client, plan, unit=UNIT_ID_INVERTER):
+    """Read all planned blocks and return {name: value}, with bitfields as integers."""
+    snapshot = {}
+    for address, count, members in plan:
+        block = read_modbus_register(client, address, count, unit)
+        for reg in members:
+            offset = reg["address"] - address
+            snapshot[reg["name"]] = decode_register(block[offset:offset + reg["length"]], reg["type"], bitfield_as_dict=False)
+    return snapshot
+
+def stream_host(host, port, unit, rate, count, plan, emit, stop):
+    """Poll one host at a fixed rate and emit one decoded snapshot per read."""
+    client = ModbusTcpClient(host, port=port)
     client.connect()
-    import pprint
+    interval = 1 / rate
+    deadline = time.monotonic()
+    emitted = 0
     try:
-        data = read_all_registers(client, registers)
-        pprint.pp(data)
+        while not stop.is_set() and (not count or emitted < count):
+            try:
+                snapshot = read_snapshot(client, plan, unit)
+                emit({"host": f"{host}:{port}", "unit": unit, "time": time.time(), **snapshot})
+                emitted += 1
+            except Exception as e:
+                print(f"{host}:{port}: {e}", file=sys.stderr)
+            deadline += interval
+            stop.wait(max(0, deadline - time.monotonic()))
     finally:
-        client.close()
\ No newline at end of file
+        client.close()
+
+def stream(hosts, unit, rate, count, output_format, out=sys.stdout):
+    """Stream snapshots of several hosts in parallel as JSON lines or CSV."""
+    plan = plan_block_reads(registers)
+    write_lock = threading.Lock()
+    if output_format == "csv":
+        names = list(dict.fromkeys(reg["name"] for reg in registers))
+        writer = csv.DictWriter(out, fieldnames=["host", "unit", "time"] + names)
+        writer.writeheader()
+        write_row = writer.writerow
+    else:
+        def write_row(row):
+            out.write(json.dumps(row) + "\n")
+
+    def emit(row):
+        with write_lock:
+            write_row(row)
+            out.flush()
+
+    stop = threading.Event()
+    threads = []
+    for host in hosts:
+        name, _, port = host.partition(":")
+        thread = threading.Thread(target=stream_host, args=(name, int(port or PORT), unit, rate, count, plan, emit, stop), daemon=True)
+        thread.start()
+        threads.append(thread)
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read the Fronius meter registers served by a gateway.")
+    parser.add_argument("hosts", nargs="*", default=[f"{HOST}:{PORT}"], help="host[:port], several are polled in parallel")
+    parser.add_argument("--unit", type=int, default=UNIT_ID_INVERTER, help="Modbus unit ID")
+    parser.add_argument("--stream", action="store_true", help="continuously stream decoded snapshots")
+    parser.add_argument("--rate", type=float, default=1.0, help="snapshots per second and host when streaming")
+    parser.add_argument("--count", type=int, default=0, help="stop after this many snapshots per host (0: run until Ctrl+C)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl", help="output format when streaming")
+    args = parser.parse_args()
+
+    if args.stream:
+        stream(args.hosts, args.unit, args.rate, args.count, args.format)
+    else:
+        import pprint
+        for host in args.hosts:
+            name, _, port = host.partition(":")
+            client = ModbusTcpClient(name, port=int(port or PORT))
+            client.connect()
+            try:
+                data = read_all_registers(client, registers, args.unit)
+                pprint.pp(data)
+            finally:
+                client.close()
@@ -0,0 +1,166 @@
+"""Compact binary recordings of meter samples.
+
+A recording is a small header followed by fixed-size little-endian records:
+one float64 Unix timestamp and one float32 per column, by default the values
+of pipeline.OUTPUT_NAMES. These are exactly the float32 values the registers
+served, so a replay serves the same image again. Records can be read in place
+from a memory map, e.g. with struct.iter_unpack or memoryview casts.
+
+Header: 8 byte magic, uint32 header size, uint32 column count, then the column
+names separated by newlines, zero padded to a multiple of 8 bytes.
+"""
+import asyncio
+import mmap
+import os
+import struct
+import time
+
+from pipeline import OUTPUT_NAMES
+
+MAGIC = b"SFGREC01"
+HEADER = struct.Struct("<8sII")
+FLUSH_INTERVAL = 10  # Seconds between writes of the buffered records
+
+
+def record_struct(columns):
+    return struct.Struct("<d" + "f" * columns)
+
+
+def encode_header(names):
+    encoded = "\n".join(names).encode("ascii")
+    header_size = (HEADER.size + len(encoded) + 7) // 8 * 8
+    return HEADER.pack(MAGIC, header_size, len(names)) + encoded.ljust(header_size - HEADER.size, b"\0")
+
+
+class Recorder:
+    """Appends one record per sample to a recording, creating it if needed.
+
+    Records are buffered and written by flush(), which run() calls every
+    interval and close() once more, so appending never touches the disk.
+    """
+
+    def __init__(self, path, names=OUTPUT_NAMES):
+        self.path = path
+        self.names = tuple(names)
+        self.record = record_struct(len(self.names))
+        self.buffer = bytearray()
+        header = encode_header(self.names)
+        existing = b""
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                existing = f.read(len(header))
+        if len(existing) == len(header) or (existing and not header.startswith(existing)):
+            with Recording(path) as recording:
+                if recording.names != self.names:
+                    raise ValueError(f"{path} was recorded with other columns, record to a new file.")
+            self.file = open(path, "ab")
+            # Drop a record torn by a crash, so appended records stay aligned
+            self.file.truncate(recording.header_size + len(recording) * self.record.size)
+        else:
+            # New, or only the start of our own header made it to disk before a crash
+            self.file = open(path, "wb")
+            self.file.write(header)
+            self.file.flush()
+
+    def append(self, timestamp, values):
+        """Buffer one sample; values may hold more entries than columns, the rest is ignored."""
+        self.buffer += self.record.pack(timestamp, *values[:len(self.names)])
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer.clear()
+
+    async def run(self, interval=FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class Recording:
+    """Read-only memory map of a recording."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"{path} has a torn header.")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.header_size, columns = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not a recording.")
+        if self.header_size > len(self.map):
+            self.map.close()
+            raise ValueError(f"{path} has a torn header.")
+        self.names = tuple(self.map[HEADER.size:self.header_size].rstrip(b"\0").decode("ascii").split("\n"))
+        if len(self.names) != columns:
+            self.map.close()
+            raise ValueError(f"{path} has a corrupt header.")
+        self.record = record_struct(columns)
+        self.count = (len(self.map) - self.header_size) // self.record.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def records(self, start=0, stop=None):
+        """Iterate (timestamp, value, value, ...) tuples of records [start, stop), read in place from the map."""
+        stop = self.count if stop is None else min(stop, self.count)
+        size = self.record.size
+        with memoryview(self.map) as view:
+            yield from self.record.iter_unpack(view[self.header_size + start * size:self.header_size + stop * size])
+
+    def column(self, name, start=0, stop=None):
+        """Iterate the values of one column of records [start, stop) in place, skipping the others."""
+        index = self.names.index(name)
+        columns = len(self.names)
+        layout = struct.Struct(f"<{8 + 4 * index}xf{4 * (columns - index - 1)}x")
+        stop = self.count if stop is None else min(stop, self.count)
+        size = self.record.size
+        with memoryview(self.map) as view:
+            for value, in layout.iter_unpack(view[self.header_size + start * size:self.header_size + stop * size]):
+                yield value
+
+    def close(self):
+        self.map.close()
+
+
+async def replay(path, speed=1.0, loop=False, names=OUTPUT_NAMES):
+    """Yield (timestamp, values) of a recording, paced like the original at speed times real time.
+
+    speed 0 replays as fast as possible, yielding to the event loop every 1000 records.
+    With loop, the recording starts over at its end.
+    """
+    with Recording(path) as recording:
+        if recording.names != tuple(names):
+            raise ValueError(f"{path} was recorded with other columns.")
+        if not len(recording):
+            raise ValueError(f"{path} holds no records.")
+        while True:
+            started = time.monotonic()
+            first = None
+            for i, record in enumerate(recording.records()):
+                timestamp = record[0]
+                if speed:
+                    if first is None:
+                        first = timestamp
+                    delay = started + (timestamp - first) / speed - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif i % 1000 == 0:
+                    await asyncio.sleep(0)
+                yield timestamp, record[1:]
+            if not loop:
+                return
@@ -151,7 +151,7 @@ def map_value_to_modbus_name(shelly_data):
     modbus_data["PPVphAB"] = PPVphAB
     modbus_data["PPVphBC"] = PPVphBC
     modbus_data["PPVphCA"] = PPVphCA
-    modbus_data["PPVph"] = PPV
+    modbus_data["PPV"] = PPV
 
     # Calculate reactive power
     rad = shelly_data["a_aprt_power"] ** 2 - shelly_data["a_act_power"] ** 2
@@ -0,0 +1,144 @@
+import asyncio
+import math
+import statistics
+import time
+from collections import deque
+
+import metrics
+
+POLL_INTERVAL = 1
+ERROR_DELAY = 2
+MIN_READ_GAP = 0.05  # Reads closer together than this belong to the same inverter cycle
+FETCH_MARGIN = 0.05  # Safety margin between finishing a fetch and the expected read
+SUMMARY_INTERVAL = 300
+
+
+class InverterReadTracker:
+    """Learns when the inverter reads the meter registers.
+
+    The datablock calls record() whenever a read touches the register window
+    [start, end); with server workers, shared.WorkerPool forwards their reads.
+    From the read times the tracker estimates the inverter's cadence, and from the
+    recorded fetch durations how long before an expected read a Shelly fetch has
+    to start. It also keeps the age of the served data at each read.
+    """
+
+    def __init__(self, start, end, name="", history=32):
+        self.start = start
+        self.end = end
+        self.name = name
+        self.reads = deque(maxlen=history)
+        self.ages = deque(maxlen=256)
+        self.fetch_durations = deque(maxlen=20)
+
+    def record(self, published_at, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.ages.append(now - published_at)
+        metrics.read_data_age.observe(now - published_at, self.name)
+        if not self.reads or now - self.reads[-1] >= MIN_READ_GAP:
+            self.reads.append(now)
+
+    def period(self):
+        """Return the inverter's read period, or None while it is unknown or irregular."""
+        if len(self.reads) < 5:
+            return None
+        reads = list(self.reads)
+        intervals = [b - a for a, b in zip(reads, reads[1:])]
+        period = statistics.median(intervals)
+        regular = sum(abs(interval - period) <= 0.2 * period for interval in intervals)
+        if regular < 0.6 * len(intervals):
+            return None
+        if time.monotonic() - reads[-1] > 4 * period:
+            return None  # The inverter stopped reading
+        return period
+
+    def lead_time(self):
+        return max(self.fetch_durations) + FETCH_MARGIN
+
+    def next_fetch_start(self, earliest):
+        """Return the first fetch start not before earliest that finishes just before an expected read."""
+        period = self.period()
+        if period is None or not self.fetch_durations:
+            return None
+        lead = self.lead_time()
+        last = self.reads[-1]
+        k = max(1, math.ceil((earliest + lead - last) / period))
+        return last + k * period - lead
+
+    def summary(self):
+        if not self.ages:
+            return None
+        ages = sorted(self.ages)
+        period = self.period()
+        cadence = f"every {period:.2f}s" if period is not None else "irregularly"
+        return (f"Inverter reads {cadence}, data age at read: median {statistics.median(ages) * 1000:.0f} ms, "
+                f"max {ages[-1] * 1000:.0f} ms over the last {len(ages)} reads")
+
+
+class PollScheduler:
+    """Polls several meters on one shared interval.
+
+    Meter i of n starts at i * interval / n into every interval, so the HTTP requests
+    of a site are spread evenly instead of all firing at once. Deadlines are absolute,
+    which keeps the phases from drifting together over time.
+
+    Once a meter's InverterReadTracker knows the inverter's cadence, the fetch that
+    precedes each expected read is shifted so that it finishes just before the read.
+    Fetches never start less than one interval apart.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL, error_delay=ERROR_DELAY):
+        self.interval = interval
+        self.error_delay = error_delay
+        self.meters = []
+
+    def add(self, meter):
+        self.meters.append(meter)
+
+    async def run(self):
+        start = time.monotonic()
+        tasks = [
+            asyncio.create_task(self.poll(meter, start + i * self.interval / len(self.meters)))
+            for i, meter in enumerate(self.meters)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def next_deadline(self, tracker, deadline):
+        earliest = deadline + self.interval
+        aligned = tracker.next_fetch_start(earliest)
+        if aligned is not None and aligned <= earliest + self.interval:
+            return aligned
+        return earliest
+
+    async def poll(self, meter, deadline=None):
+        if deadline is None:
+            deadline = time.monotonic()
+        tracker = meter.read_tracker
+        last_summary = time.monotonic()
+        while True:
+            await asyncio.sleep(max(0, deadline - time.monotonic()))
+            started = time.monotonic()
+            try:
+                await meter.update_context()
+                tracker.fetch_durations.append(time.monotonic() - started)
+                next_deadline = self.next_deadline(tracker, deadline)
+            except Exception as e:
+                meter.log(f"Failed to update data: {e}")
+                metrics.poll_failures.inc(meter.name)
+                next_deadline = deadline + self.error_delay  # Sleep a bit longer after an error
+            # Skip slots that were missed while the fetch was running
+            now = time.monotonic()
+            if next_deadline < now:
+                next_deadline += math.ceil((now - next_deadline) / self.interval) * self.interval
+            deadline = next_deadline
+
+            if now - last_summary >= SUMMARY_INTERVAL:
+                last_summary = now
+                summary = tracker.summary()
+                if summary:
+                    meter.log(summary)
@@ -0,0 +1,338 @@
+"""Serving the register images from several worker processes.
+
+The gateway process keeps polling and publishes every datablock's image into
+multiprocessing.shared_memory. Worker processes each run a Modbus server on the
+same port (SO_REUSEPORT, Linux) and answer reads from those images, so read
+capacity grows with the number of cores instead of sharing one GIL with the poller.
+
+Shared memory layout of one image, native byte order header:
+    uint64 version       odd while the gateway is copying a new image (seqlock)
+    float64 published_at time.monotonic() of the publication
+    float64 read_at      time.monotonic() of the last read in the tracked window
+    uint32 checksum      CRC-32 of the registers
+followed by the registers as big-endian uint16, i.e. ready to send. The gateway
+writes version, published_at and checksum, the workers only read_at.
+
+The version alone only guarantees a consistent copy where stores become visible in
+program order, as on x86. On ARM a worker may see the new version before all new
+registers, so workers also check the copied registers against the checksum, and
+cache responses per checksum rather than per version.
+"""
+import asyncio
+import datetime
+import os
+import signal
+import socket
+import struct
+import time
+import zlib
+from multiprocessing import get_context, shared_memory
+
+from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu.register_message import ReadHoldingRegistersRequest, ReadInputRegistersRequest
+from pymodbus.server import ModbusTcpServer
+
+from modbus import CachedReadHoldingRegistersRequest, CachedReadInputRegistersRequest, MAX_ENCODED_RANGES
+
+HEADER = struct.Struct("=QddI4x")
+STAMP = struct.Struct("=Qd")  # version and published_at
+VERSION = struct.Struct("=Q")
+PUBLISHED_AT = READ_AT = struct.Struct("=d")
+CHECKSUM = struct.Struct("=I")
+PUBLISHED_AT_OFFSET = 8
+READ_AT_OFFSET = 16
+CHECKSUM_OFFSET = 24
+READ_RETRIES = 100  # Attempts to copy a consistent image before answering SLAVE_FAILURE
+READ_POLL_INTERVAL = 0.02  # How often the gateway collects the workers' inverter reads
+WORKER_START_TIMEOUT = 10
+WORKER_CHECK_INTERVAL = 1  # How often the gateway checks its workers and the workers their gateway
+WRITE_FUNCTION_CODES = (5, 6, 15, 16, 22, 23)
+
+
+class SharedImage:
+    """Register image of one datablock in shared memory.
+
+    The gateway creates it (name None) and publishes images; workers attach by name
+    and read. Readers retry while the version is odd, changed during their copy or
+    the copy does not match the checksum.
+    """
+
+    def __init__(self, address, length, name=None):
+        self.address = address
+        self.length = length
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=HEADER.size + 2 * length)
+        self.name = self.shm.name
+        self.end = HEADER.size + 2 * length
+        self.registers = struct.Struct(f">{length}H")
+        if name is None:
+            HEADER.pack_into(self.shm.buf, 0, 0, time.monotonic(), 0.0, zlib.crc32(bytes(2 * length)))
+
+    def publish(self, values, published_at):
+        buf = self.shm.buf
+        version = VERSION.unpack_from(buf, 0)[0]
+        VERSION.pack_into(buf, 0, version + 1)
+        self.registers.pack_into(buf, HEADER.size, *values)
+        self.seal(version + 2, published_at)
+
+    def publish_spans(self, spans, published_at):
+        """Publish only [(offset, values)], the registers that changed since the last image."""
+        buf = self.shm.buf
+        version = VERSION.unpack_from(buf, 0)[0]
+        VERSION.pack_into(buf, 0, version + 1)
+        for offset, values in spans:
+            struct.pack_into(f">{len(values)}H", buf, HEADER.size + 2 * offset, *values)
+        self.seal(version + 2, published_at)
+
+    def seal(self, version, published_at):
+        """Checksum the new registers and end the write, leaving read_at to the workers."""
+        buf = self.shm.buf
+        CHECKSUM.pack_into(buf, CHECKSUM_OFFSET, zlib.crc32(buf[HEADER.size:self.end]))
+        STAMP.pack_into(buf, 0, version, published_at)
+
+    def touch(self, published_at):
+        """Mark the current image as confirmed by a newer sample.
+
+        A bare store outside the seqlock: the registers and their checksum stay as they
+        are, and published_at is only read back by the gateway itself (last_read()).
+        """
+        PUBLISHED_AT.pack_into(self.shm.buf, PUBLISHED_AT_OFFSET, published_at)
+
+    def read(self, address, count):
+        """Return (checksum, big-endian register bytes) of one consistent image.
+
+        Raises TimeoutError if no consistent copy succeeds within READ_RETRIES
+        attempts, e.g. because the gateway died while publishing.
+        """
+        buf = self.shm.buf
+        start = 2 * (address - self.address)
+        for _ in range(READ_RETRIES):
+            version = VERSION.unpack_from(buf, 0)[0]
+            if not version & 1:
+                checksum = CHECKSUM.unpack_from(buf, CHECKSUM_OFFSET)[0]
+                image = bytes(buf[HEADER.size:self.end])
+                if zlib.crc32(image) == checksum and VERSION.unpack_from(buf, 0)[0] == version:
+                    return checksum, image[start:start + 2 * count]
+            # Let the gateway finish its write, it may share this core
+            os.sched_yield()
+        raise TimeoutError("No consistent register image in shared memory")
+
+    def checksum(self):
+        return CHECKSUM.unpack_from(self.shm.buf, CHECKSUM_OFFSET)[0]
+
+    def note_read(self):
+        READ_AT.pack_into(self.shm.buf, READ_AT_OFFSET, time.monotonic())
+
+    def last_read(self):
+        """Return (read_at, published_at) as last written by the workers and the gateway."""
+        _, published_at, read_at, _ = HEADER.unpack_from(self.shm.buf, 0)
+        return read_at, published_at
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class SharedDataBlock:
+    """Read-only datablock of a worker, served from a SharedImage.
+
+    Implements the reading half of pymodbus' datablock interface, writes are refused
+    by ReadOnlySlaveContext before they get here. Reads overlapping the tracked window
+    [tracked_start, tracked_end) are noted in the image for the gateway's
+    InverterReadTracker. getEncoded() caches response payloads per (address, count)
+    and image checksum.
+    """
+
+    def __init__(self, image, tracked_start, tracked_end):
+        self.image = image
+        self.address = image.address
+        self.default_value = 0
+        self.tracked_start = tracked_start
+        self.tracked_end = tracked_end
+        self.encoded = {}
+
+    def validate(self, address, count=1):
+        return self.address <= address and address + count <= self.address + self.image.length
+
+    def track_read(self, address, count):
+        if address < self.tracked_end and address + count > self.tracked_start:
+            self.image.note_read()
+
+    def getValues(self, address, count=1):
+        _, data = self.image.read(address, count)
+        self.track_read(address, count)
+        return list(struct.unpack(f">{count}H", data))
+
+    async def async_getValues(self, address, count=1):
+        return self.getValues(address, count)
+
+    def getEncoded(self, address, count=1):
+        key = (address, count)
+        cached = self.encoded.get(key)
+        if cached is not None and cached[0] == self.image.checksum():
+            self.track_read(address, count)
+            return cached[1]
+        checksum, data = self.image.read(address, count)
+        self.track_read(address, count)
+        payload = bytes((2 * count,)) + data
+        if len(self.encoded) >= MAX_ENCODED_RANGES:
+            self.encoded.clear()
+        self.encoded[key] = (checksum, payload)
+        return payload
+
+
+class ReadOnlySlaveContext(ModbusSlaveContext):
+    """Slave context of a worker: writes are answered with ILLEGAL_ADDRESS, only the gateway writes."""
+
+    def validate(self, fc_as_hex, address, count=1):
+        return fc_as_hex not in WRITE_FUNCTION_CODES and super().validate(fc_as_hex, address, count)
+
+
+class ImageReadRequest:
+    """Answers SLAVE_FAILURE when SharedImage.read() finds no consistent image."""
+
+    async def update_datastore(self, context):
+        try:
+            return await super().update_datastore(context)
+        except TimeoutError:
+            return ExceptionResponse(self.function_code, ExceptionResponse.SLAVE_FAILURE)
+
+
+class ImageReadHoldingRegistersRequest(ImageReadRequest, ReadHoldingRegistersRequest):
+    pass
+
+
+class ImageReadInputRegistersRequest(ImageReadRequest, ReadInputRegistersRequest):
+    pass
+
+
+class CachedImageReadHoldingRegistersRequest(ImageReadRequest, CachedReadHoldingRegistersRequest):
+    pass
+
+
+class CachedImageReadInputRegistersRequest(ImageReadRequest, CachedReadInputRegistersRequest):
+    pass
+
+
+IMAGE_REQUESTS = [ImageReadHoldingRegistersRequest, ImageReadInputRegistersRequest]
+CACHED_IMAGE_REQUESTS = [CachedImageReadHoldingRegistersRequest, CachedImageReadInputRegistersRequest]
+
+
+def reuse_port_socket(port):
+    """Return a TCP socket bound to port with SO_REUSEPORT, so all workers can bind it."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("0.0.0.0", port))
+    return sock
+
+
+async def serve(port, images, single, tracked, response_cache, parent, ready):
+    blocks = {unit_id: SharedDataBlock(SharedImage(address, length, name), *tracked)
+              for unit_id, (name, address, length) in images.items()}
+    slaves = {unit_id: ReadOnlySlaveContext(di=block, co=block, hr=block, ir=block) for unit_id, block in blocks.items()}
+    context = ModbusServerContext(slaves=slaves[0] if single else slaves, single=single)
+    server = ModbusTcpServer(context=context, address=("0.0.0.0", port),
+                             custom_pdu=CACHED_IMAGE_REQUESTS if response_cache else IMAGE_REQUESTS)
+    # Every worker listens on the same port, the kernel spreads the connections
+    loop = asyncio.get_running_loop()
+    listener = await loop.create_server(server.handle_new_connection, sock=reuse_port_socket(port))
+    ready.set()
+
+    # The gateway stops the workers with SIGTERM, Ctrl+C is its business
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    # Stop serving the last image if the gateway went away without stopping us
+    while os.getppid() == parent and not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), WORKER_CHECK_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+    listener.close()
+    await server.shutdown()
+    for block in blocks.values():
+        block.image.close()
+
+
+def run_worker(port, images, single, tracked, response_cache, parent, ready):
+    asyncio.run(serve(port, images, single, tracked, response_cache, parent, ready))
+
+
+class WorkerPool:
+    """Publishes the gateway's datablocks to shared memory and runs the worker processes.
+
+    datablocks is {unit_id: SnapshotDataBlock} as returned by
+    initialize_datablock_and_context(), single tells whether one block answers all units.
+    start() returns once every worker listens, monitor() restarts workers that exit.
+    """
+
+    def __init__(self, datablocks, single, workers, port, tracked, response_cache=True):
+        self.images = {}
+        for unit_id, datablock in datablocks.items():
+            image = SharedImage(datablock.address, len(datablock.values))
+            image.publish(datablock.values, datablock.published_at)
+            datablock.shared = image
+            self.images[unit_id] = image
+        spec = {unit_id: (image.name, image.address, image.length) for unit_id, image in self.images.items()}
+        self.args = (port, spec, single, tracked, response_cache, os.getpid())
+        self.context = get_context("spawn")
+        self.workers = workers
+        self.processes = []
+        self.port = port
+
+    def spawn(self):
+        ready = self.context.Event()
+        process = self.context.Process(target=run_worker, args=(*self.args, ready), daemon=True)
+        process.start()
+        return process, ready
+
+    async def wait_ready(self, process, ready):
+        """Wait until a worker listens, raising RuntimeError if it exits or takes too long."""
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while not ready.is_set():
+            if not process.is_alive():
+                raise RuntimeError(f"Modbus server worker {process.pid} exited with code {process.exitcode} while starting")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Modbus server worker {process.pid} did not start within {WORKER_START_TIMEOUT}s")
+            await asyncio.sleep(0.05)
+
+    async def start(self):
+        print(f"{datetime.datetime.now()}: ### Starting {self.workers} Modbus server workers on port {self.port}")
+        self.processes = [self.spawn() for _ in range(self.workers)]
+        for process, ready in self.processes:
+            await self.wait_ready(process, ready)
+
+    async def monitor(self):
+        """Restart workers that exited; raises RuntimeError if a restarted worker does not start."""
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            for i, (process, _) in enumerate(self.processes):
+                if not process.is_alive():
+                    print(f"{datetime.datetime.now()}: ⚠️  Modbus server worker {process.pid} exited with code "
+                          f"{process.exitcode}, restarting it")
+                    self.processes[i] = self.spawn()
+                    await self.wait_ready(*self.processes[i])
+
+    async def collect_reads(self, trackers):
+        """Forward the reads noted by the workers to {unit_id: InverterReadTracker}."""
+        last = {unit_id: 0.0 for unit_id in trackers}
+        while True:
+            await asyncio.sleep(READ_POLL_INTERVAL)
+            for unit_id, tracker in trackers.items():
+                read_at, published_at = self.images[unit_id].last_read()
+                if read_at != last[unit_id]:
+                    last[unit_id] = read_at
+                    tracker.record(published_at, read_at)
+
+    def stop(self):
+        for process, _ in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process, _ in self.processes:
+            process.join(5)
+        for image in self.images.values():
+            image.close()
+            image.unlink()
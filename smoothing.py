@@ -0,0 +1,60 @@
+import statistics
+from array import array
+
+SMOOTHING_METHODS = ("mean", "median", "ema")
+
+
+class WindowSmoother:
+    """Replaces the instantaneous values of each sample by an aggregate over the last samples.
+
+    Every smoothed column has its own array-backed ring buffer of window samples. mean and
+    median aggregate the filled part of the buffers, ema is an exponential moving average
+    with the span of the window (alpha = 2 / (window + 1)) and needs no buffer. Columns
+    not listed, like the energy counters, pass through unchanged.
+    """
+
+    def __init__(self, method, window, columns):
+        if method not in SMOOTHING_METHODS:
+            raise ValueError(f"Smoothing method must be one of {SMOOTHING_METHODS}.")
+        if not isinstance(window, int) or window < 1:
+            raise ValueError("Smoothing window must be a positive integer.")
+        self.method = method
+        self.window = window
+        self.columns = columns
+        self.alpha = 2 / (window + 1)
+        self.buffers = [array("d", [0.0]) * window for _ in columns] if method != "ema" else []
+        self.position = 0
+        self.count = 0
+        self.ema = None
+
+    def add(self, values):
+        """Add one sample, a sequence of values in encoder slot order, and return the smoothed list."""
+        values = list(values)
+        columns = self.columns
+        if self.method == "ema":
+            ema = self.ema
+            if ema is None:
+                self.ema = [values[column] for column in columns]
+                return values
+            alpha = self.alpha
+            for i, column in enumerate(columns):
+                ema[i] += alpha * (values[column] - ema[i])
+                values[column] = ema[i]
+            return values
+
+        position = self.position
+        for buffer, column in zip(self.buffers, columns):
+            buffer[position] = values[column]
+        self.position = (position + 1) % self.window
+        if self.count < self.window:
+            self.count += 1
+        count = self.count
+        full = count == self.window
+
+        if self.method == "mean":
+            for buffer, column in zip(self.buffers, columns):
+                values[column] = sum(buffer if full else buffer[:count]) / count
+        else:
+            for buffer, column in zip(self.buffers, columns):
+                values[column] = statistics.median(buffer if full else buffer[:count])
+        return values
@@ -0,0 +1,108 @@
+"""Persisted gateway state: the last good register image and the offsets of every meter.
+
+The state file is small JSON, rewritten atomically (temporary file, fsync, rename) so
+a crash or power loss leaves either the old or the new state, never a torn one.
+"""
+import asyncio
+import datetime
+import json
+import math
+import os
+import time
+
+STATE_FILE = "state.json"
+SAVE_INTERVAL = 60  # Seconds between saves of fresh register images
+CHECK_INTERVAL = 1  # Changed offsets are saved within this many seconds
+
+
+def load_state(path):
+    """Return {meter name: {"offsets", "registers", "time"}}, empty if there is no usable state file."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"{datetime.datetime.now()}: ⚠️  Ignoring unreadable state file {path}: {e}")
+        return {}
+    if not isinstance(state, dict):
+        print(f"{datetime.datetime.now()}: ⚠️  Ignoring state file {path}, it holds no meters")
+        return {}
+    valid = {}
+    for name, entry in state.items():
+        if valid_entry(entry):
+            valid[name] = entry
+        else:
+            print(f"{datetime.datetime.now()}: ⚠️  Ignoring malformed state of {name} in {path}")
+    return valid
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def valid_entry(entry):
+    """Check the shape and types of one meter's state, so restoring it cannot fail."""
+    if not isinstance(entry, dict):
+        return False
+    offsets, registers, saved_at = entry.get("offsets"), entry.get("registers"), entry.get("time")
+    return (isinstance(offsets, dict) and all(is_number(value) for value in offsets.values())
+            and isinstance(registers, list)
+            and all(isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 0xFFFF
+                    for value in registers)
+            and is_number(saved_at) and 0 <= saved_at < 1e11)
+
+
+def write_state(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class StatePersister:
+    """Writes the meters' state to the state file.
+
+    Saves right after a meter's offsets change and every interval while new register
+    images arrive. Entries of meters without live data yet are kept from the loaded state.
+    """
+
+    def __init__(self, path, meters, interval=SAVE_INTERVAL):
+        self.path = path
+        self.meters = meters
+        self.interval = interval
+        self.state = load_state(path)
+        self.saved_offsets = {}
+        self.saved_at = time.monotonic()
+
+    async def save(self):
+        for meter in self.meters:
+            state = meter.state()
+            if state is not None:
+                self.state[meter.name] = state
+                self.saved_offsets[meter.name] = meter.offsets_version
+        self.saved_at = time.monotonic()
+        try:
+            await asyncio.to_thread(write_state, self.path, dict(self.state))
+        except OSError as e:
+            print(f"{datetime.datetime.now()}: Failed to save state to {self.path}: {e}")
+
+    def offsets_changed(self):
+        return any(meter.state() is not None and self.saved_offsets.get(meter.name) != meter.offsets_version
+                   for meter in self.meters)
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(CHECK_INTERVAL)
+                if self.offsets_changed() or time.monotonic() - self.saved_at >= self.interval:
+                    await self.save()
+        finally:
+            await self.save()